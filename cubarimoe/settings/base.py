@@ -49,6 +49,10 @@ INSTALLED_APPS = [
 
 INTERNAL_IPS = ("127.0.0.1",)
 
+# View counts are buffered in memory and written to the database in one batch
+# per worker this often, in seconds.
+HIT_FLUSH_INTERVAL = 30
+
 ROOT_URLCONF = "cubarimoe.urls"
 
 CACHES = {
@@ -59,6 +63,7 @@ CACHES = {
 }
 
 MIDDLEWARE = [
+    "proxy.middleware.ServerTimingMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -167,4 +172,74 @@ SECONDARY_PROXY_URL = os.environ.get("SECONDARY_PROXY_URL", EXTERNAL_PROXY_URL)
 
 PROXY_BASE_PATH = "read"
 
-METRICS_ENDPOINT = ""
\ No newline at end of file
+METRICS_ENDPOINT = ""
+# Serve stale api_cache entries immediately and refresh them on a background
+# thread; if disabled, the refresh happens inline and only falls back to the
+# stale value when the upstream fails.
+PROXY_CACHE_BACKGROUND_REFRESH = True
+
+# In-process LRU in front of the Django cache for proxy api_cache entries.
+# TTL is in seconds and kept short, since workers don't share invalidations.
+PROXY_LOCAL_CACHE = {
+    "MAX_ENTRIES": 256,
+    "MAX_BYTES": 64 * 1024 * 1024,
+    "TTL": 10,
+}
+
+# Seconds to remember that an upstream failed or returned nothing, so repeat
+# requests get the cached error page instead of another outbound fetch.
+PROXY_NEGATIVE_CACHE_TTL = 60
+
+# Keep-alive connection pool size per upstream hostname for the proxy sources.
+PROXY_CONNECTION_POOLS = {
+    "default": 4,
+    "services.f-ck.me": 32,
+    "api.mangadex.org": 16,
+    "weebcentral.com": 8,
+    "imgur.com": 8,
+}
+
+# Max in-flight upstream requests per hostname, per worker process. Requests
+# over the cap fail fast so one slow host can't hold every thread.
+PROXY_BULKHEADS = {
+    "default": 8,
+    "api.mangadex.org": 16,
+    "weebcentral.com": 4,
+}
+
+# Optional cluster-wide caps per hostname, counted through the cache.
+PROXY_CLUSTER_BULKHEADS = {}
+
+# Route sources with native async handlers to async views. Only worth it when
+# served through cubarimoe.asgi, where one worker can hold many in-flight
+# upstream requests; under WSGI each request gets a throwaway event loop.
+PROXY_ASYNC_VIEWS = False
+PROXY_ASYNC_CONNECTION_LIMIT = 256
+
+# Batch chapter API: most chapters accepted per request, how many of them are
+# resolved concurrently, and how many batches a client may post.
+PROXY_CHAPTER_BATCH_MAX = 50
+PROXY_CHAPTER_BATCH_WORKERS = 6
+PROXY_CHAPTER_BATCH_RATE = "20/m"
+
+# Background threads per worker warming the next chapter for sources with
+# prefetch_next_chapter set, and how many warm-ups may wait; 0 workers disables.
+PROXY_PREFETCH = {
+    "WORKERS": 2,
+    "QUEUE_SIZE": 128,
+}
+
+# Defaults for the warm_proxy_cache command: how many of each source's most
+# read series to keep warm, seconds between passes when looping, and seconds
+# to pause after each upstream fetch.
+PROXY_WARMER = {
+    "TOP": 50,
+    "INTERVAL": 300,
+    "PAUSE": 1.0,
+}
+
+# Add a Server-Timing header to proxy responses breaking down where the time
+# went, and log a sample of the requests slower than PROXY_SLOW_REQUEST_SECONDS.
+PROXY_SERVER_TIMING = False
+PROXY_SLOW_REQUEST_SECONDS = 2
+PROXY_SLOW_REQUEST_SAMPLE_RATE = 0.1
@@ -2,28 +2,30 @@ import random as r
 
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.cache import cache
 from django.shortcuts import redirect, render
 from django.utils.decorators import decorator_from_middleware
 from django.views.decorators.cache import cache_control
 from django.http.response import HttpResponsePermanentRedirect
 
 from homepage.middleware import ForwardParametersMiddleware
+from proxy.source.breaker import breaker_states
+from proxy.source.bulkhead import bulkhead_states
 from reader.middleware import OnlineNowMiddleware
+from reader.users_cache_lib import online_now, peak_traffic
 from reader.views import series_page_data
 
 
 @staff_member_required
 @cache_control(public=True, max_age=30, s_maxage=30)
 def admin_home(request):
-    online = cache.get("online_now")
-    peak_traffic = cache.get("peak_traffic")
     return render(
         request,
         "homepage/admin_home.html",
         {
-            "online": len(online) if online else 0,
-            "peak_traffic": peak_traffic,
+            "online": online_now(),
+            "peak_traffic": peak_traffic(),
+            "breakers": breaker_states(),
+            "bulkheads": bulkhead_states(),
             "template": "home",
             "version_query": settings.STATIC_VERSION,
         },
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from time import time as unix_time
+
+import markdown
+from django.conf import settings
+from django.core.cache import cache
+from django.template import Template
+
+# Rendered pages are cached under a version stamp that misc.signals bumps
+# whenever a Page, Variable or Static changes, so a stale page is never
+# served and nothing needs to be deleted. The stamp starts from the clock so
+# that an evicted stamp can't bring back pages rendered under an older one.
+PAGES_VERSION_KEY = "misc_pages_version"
+PAGE_TTL = 3600 * 24
+# Pages that don't exist are remembered only briefly, since any slug can be
+# asked for.
+MISSING_PAGE_TTL = 60
+COMPILED_TEMPLATES = 64
+MARKDOWN_TTL = 3600 * 24 * 7
+
+# The pages listing is cached as one of these per page. The preview is the
+# listing's rendered and truncated content, so the index never carries whole
+# pages.
+PageListing = namedtuple(
+    "PageListing", ("page_title", "page_url", "preview", "cover_image_url", "date")
+)
+
+# Per-process LRU of compiled standalone page templates.
+_compiled = OrderedDict()
+_lock = threading.Lock()
+
+
+def reset_compiled_templates():
+    global _lock
+    _compiled.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_compiled_templates)
+
+
+def pages_version():
+    version = cache.get(PAGES_VERSION_KEY)
+    if version is None:
+        cache.add(PAGES_VERSION_KEY, int(unix_time()), None)
+        version = cache.get(PAGES_VERSION_KEY)
+    return version
+
+
+def bump_pages_version():
+    try:
+        cache.incr(PAGES_VERSION_KEY)
+    except ValueError:
+        cache.add(PAGES_VERSION_KEY, int(unix_time()), None)
+
+
+def page_cache_key(version, page_url):
+    # Rendered pages link static files under STATIC_VERSION, so they're
+    # rendered again after a deploy. The URL comes from the request, so it's
+    # hashed to keep the key within memcached's 250 byte limit.
+    static = hashlib.md5(settings.STATIC_VERSION.encode()).hexdigest()[:8]
+    url = hashlib.sha1(page_url.encode()).hexdigest()
+    return f"misc_page_{version}_{static}_{url}"
+
+
+def page_index_key(version):
+    return f"misc_pages_{version}"
+
+
+def compiled_template(page, version):
+    key = (page.id, version)
+    with _lock:
+        template = _compiled.get(key)
+        if template:
+            _compiled.move_to_end(key)
+            return template
+    template = Template(page.content)
+    with _lock:
+        _compiled[key] = template
+        while len(_compiled) > COMPILED_TEMPLATES:
+            _compiled.popitem(last=False)
+    return template
+
+
+def _markdown_key(text):
+    return f"markdown_{hashlib.sha1(text.encode()).hexdigest()}"
+
+
+def store_markdown(text):
+    """Renders text to HTML and stores it under the hash of text. Pages are
+    stored this way when they're saved, so serving them doesn't render."""
+    html = markdown.markdown(text, extensions=["markdown.extensions.extra"])
+    cache.set(_markdown_key(text), html, MARKDOWN_TTL)
+    return html
+
+
+@lru_cache(maxsize=64)
+def render_markdown(text):
+    return cache.get(_markdown_key(text)) or store_markdown(text)
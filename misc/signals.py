@@ -2,10 +2,11 @@ import os
 import shutil
 
 from django.conf import settings
-from django.db.models.signals import post_delete
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from misc.models import Page, Static
+from misc.models import Page, Static, Variable
+from misc.page_cache import bump_pages_version, store_markdown
 
 
 @receiver(post_delete, sender=Page)
@@ -18,3 +19,21 @@ def delete_page(sender, instance, **kwargs):
 def delete_static_file(sender, instance, **kwargs):
     if instance.static_file and os.path.isfile(instance.static_file.path):
         os.remove(instance.static_file.path)
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+@receiver(post_save, sender=Variable)
+@receiver(post_delete, sender=Variable)
+@receiver(post_save, sender=Static)
+@receiver(post_delete, sender=Static)
+@receiver(m2m_changed, sender=Page.variable.through)
+def bump_page_version(sender, **kwargs):
+    bump_pages_version()
+
+
+@receiver(post_save, sender=Page)
+def render_page_markdown(sender, instance, **kwargs):
+    for text in (instance.content, instance.preview):
+        if text:
+            store_markdown(text)
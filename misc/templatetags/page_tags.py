@@ -1,8 +1,8 @@
-import markdown
 from django import template
 from django.template.defaultfilters import stringfilter
 
 from misc.models import Page
+from misc.page_cache import render_markdown
 
 register = template.Library()
 
@@ -10,4 +10,4 @@ register = template.Library()
 @register.filter()
 @stringfilter
 def convert_to_markdown(value):
-    return markdown.markdown(value, extensions=["markdown.extensions.extra"])
+    return render_markdown(value)
@@ -1,3 +1,128 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+
+from reader.models import HitCount
+
+from .models import Page, Static, Variable
+from .page_cache import (
+    MISSING_PAGE_TTL,
+    _markdown_key,
+    page_cache_key,
+    page_index_key,
+    pages_version,
+    render_markdown,
+)
+from .views import _write_hits, content, hit_count, misc_pages, page_hits
+
+
+@override_settings(STATIC_VERSION="?v=test")
+class MiscTestCase(TestCase):
+    # Migrations aren't committed, so the tables are created for the tests.
+    models = (Variable, Page, Static, HitCount)
+
+    @classmethod
+    def setUpClass(cls):
+        existing = connection.introspection.table_names()
+        with connection.schema_editor() as editor:
+            for model in cls.models:
+                if model._meta.db_table not in existing:
+                    editor.create_model(model)
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+
+
+class HitCountTests(MiscTestCase):
+    def tearDown(self):
+        page_hits.reset()
+
+    def test_hits_written_for_existing_pages(self):
+        Page.objects.create(page_url="about", page_title="About")
+        _write_hits({("page", "about"): 3, ("page", "missing"): 2})
+        _write_hits({("page", "about"): 1})
+        self.assertEqual(
+            list(HitCount.objects.values_list("proxy_type", "proxy_content", "hits")),
+            [("page", "about", 4)],
+        )
+
+    def test_view_counts_each_ip_once_a_minute(self):
+        factory = RequestFactory()
+        for ip in ("1.1.1.1", "1.1.1.1", "2.2.2.2"):
+            hit_count(factory.post("/", {"page_url": "about"}, REMOTE_ADDR=ip))
+        self.assertEqual(page_hits.pending, {("page", "about"): 2})
+
+
+class PageCacheTests(MiscTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        Page.objects.create(
+            page_url="about",
+            page_title="About",
+            standalone=True,
+            content="{{ page_title }} {{ version_query }}",
+        )
+
+    def get(self, page_url):
+        return content(self.factory.get("/"), page_url).content.decode()
+
+    def test_rendered_once_per_version(self):
+        self.assertEqual(self.get("about").strip(), "About ?v=test")
+        Page.objects.filter(page_url="about").update(content="Changed")
+        self.assertEqual(self.get("about").strip(), "About ?v=test")
+        # Saving a page bumps the version.
+        Page.objects.get(page_url="about").save()
+        self.assertEqual(self.get("about"), "Changed")
+
+    def test_static_version_in_key(self):
+        key = page_cache_key(pages_version(), "about")
+        with self.settings(STATIC_VERSION="?v=other\n"):
+            self.assertNotEqual(page_cache_key(pages_version(), "about"), key)
+
+    def test_long_urls_fit_memcached_keys(self):
+        key = page_cache_key(pages_version(), "a" * 500)
+        self.assertLessEqual(len(key), 250)
+        self.assertNotEqual(key, page_cache_key(pages_version(), "a" * 499))
+
+    def test_missing_pages_remembered_briefly(self):
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            with self.assertRaises(Http404):
+                content(self.factory.get("/"), "missing")
+        cache_set.assert_called_once_with(
+            page_cache_key(pages_version(), "missing"), False, MISSING_PAGE_TTL
+        )
+
+
+class PageIndexTests(MiscTestCase):
+    def test_index_lists_visible_pages_until_a_change(self):
+        Page.objects.create(page_url="news", page_title="News", content="**Hi**")
+        Page.objects.create(page_url="secret", page_title="Secret", hidden=True)
+        misc_pages(RequestFactory().get("/"))
+        listing = cache.get(page_index_key(pages_version()))
+        self.assertEqual([page.page_url for page in listing], ["news"])
+        self.assertIn("<strong>Hi</strong>", listing[0].preview)
+        Page.objects.create(page_url="more", page_title="More")
+        self.assertIsNone(cache.get(page_index_key(pages_version())))
+
+
+class MarkdownTests(MiscTestCase):
+    def setUp(self):
+        super().setUp()
+        render_markdown.cache_clear()
+
+    def test_saving_a_page_stores_its_markdown(self):
+        Page.objects.create(page_url="news", page_title="News", content="*Hi*")
+        self.assertEqual(cache.get(_markdown_key("*Hi*")), "<p><em>Hi</em></p>")
+
+    def test_rendered_from_the_cache(self):
+        cache.set(_markdown_key("*Hi*"), "<p>stored</p>")
+        self.assertEqual(render_markdown("*Hi*"), "<p>stored</p>")
+
+    def test_rendered_on_a_miss(self):
+        self.assertEqual(render_markdown("*Hi*"), "<p><em>Hi</em></p>")
+        self.assertEqual(cache.get(_markdown_key("*Hi*")), "<p><em>Hi</em></p>")
@@ -1,21 +1,49 @@
 import json
 
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
-from django.db.models import F
 from django.http import Http404, HttpResponse
 from django.shortcuts import render
-from django.template import Context, Template
+from django.template import Context
+from django.template.defaultfilters import truncatewords
 from django.utils.decorators import decorator_from_middleware
 from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
 
+from reader.hit_buffer import HitBuffer, bulk_add_hits
 from reader.middleware import OnlineNowMiddleware
 from reader.models import HitCount
 from reader.users_cache_lib import get_user_ip
 
 from .models import Page
+from .page_cache import (
+    MISSING_PAGE_TTL,
+    PAGE_TTL,
+    PageListing,
+    compiled_template,
+    page_cache_key,
+    page_index_key,
+    pages_version,
+)
+from .templatetags.page_tags import convert_to_markdown
+
+
+def _write_hits(pending):
+    """Adds buffered page hits to HitCount under ("page", page_url), for the
+    pages that exist."""
+    page_urls = set(
+        Page.objects.filter(page_url__in={key[1] for key in pending}).values_list(
+            "page_url", flat=True
+        )
+    )
+    bulk_add_hits(
+        HitCount,
+        ("proxy_type", "proxy_content"),
+        {key: count for key, count in pending.items() if key[1] in page_urls},
+    )
+
+
+page_hits = HitBuffer("misc", _write_hits)
 
 
 @csrf_exempt
@@ -23,28 +51,21 @@ from .models import Page
 def hit_count(request):
     if request.method == "POST":
         user_ip = get_user_ip(request)
-        page_id = f"url_{request.POST['page_url']}/{user_ip}"
-        if not cache.get(page_id):
-            cache.set(page_id, page_id, 60)
-            page_url = request.POST["page_url"]
-            page_id = Page.objects.get(page_url=page_url).id
-            page = ContentType.objects.get(app_label="misc", model="page")
-            hit, _ = HitCount.objects.get_or_create(
-                content_type=page, object_id=page_id
-            )
-            hit.hits = F("hits") + 1
-            hit.save()
+        page_url = request.POST["page_url"]
+        page_id = f"url_{page_url}/{user_ip}"
+        # Longer URLs don't fit HitCount.proxy_content.
+        if len(page_url) <= 128 and cache.add(page_id, page_id, 60):
+            page_hits.add(("page", page_url))
 
     return HttpResponse(json.dumps({}), content_type="application/json")
 
 
-@cache_control(public=True, max_age=3600, s_maxage=60)
-@decorator_from_middleware(OnlineNowMiddleware)
-def content(request, page_url):
-    try:
-        page = Page.objects.get(page_url=page_url)
-    except Page.DoesNotExist:
-        raise Http404("Page does not exist.")
+def _render_page(page_url, version):
+    """The cached form of a page: standalone pages are rendered in full,
+    others keep the context for misc/misc.html. False if there's no page."""
+    page = Page.objects.filter(page_url=page_url).first()
+    if not page:
+        return False
     content = page.content
     for var in page.variable.all():
         content = content.replace("{{%s}}" % var.key, var.value)
@@ -61,23 +82,49 @@ def content(request, page_url):
         "version_query": settings.STATIC_VERSION,
     }
     if page.standalone:
-        template = Template(page.content)
-        return HttpResponse(
-            template.render(Context(template_tags)), content_type="text/html"
-        )
-    else:
-        return render(request, "misc/misc.html", template_tags)
+        template = compiled_template(page, version)
+        return {"html": template.render(Context(template_tags))}
+    return {"html": None, "context": template_tags}
+
+
+@cache_control(public=True, max_age=3600, s_maxage=60)
+@decorator_from_middleware(OnlineNowMiddleware)
+def content(request, page_url):
+    version = pages_version()
+    key = page_cache_key(version, page_url)
+    page = cache.get(key)
+    if page is None:
+        page = _render_page(page_url, version)
+        cache.set(key, page, PAGE_TTL if page else MISSING_PAGE_TTL)
+    if not page:
+        raise Http404("Page does not exist.")
+    if page["html"] is not None:
+        return HttpResponse(page["html"], content_type="text/html")
+    return render(request, "misc/misc.html", page["context"])
 
 
 @cache_control(public=True, max_age=300, s_maxage=60)
 @decorator_from_middleware(OnlineNowMiddleware)
 def misc_pages(request):
-    pages = cache.get("misc_pages")
-    if not pages:
-        pages = Page.objects.filter(hidden=False).order_by("-date")
-        cache.set("misc_pages", pages, 3600 * 8)
-    for page in pages:
-        page.date = int(page.date.timestamp()) if page.date else ""
+    key = page_index_key(pages_version())
+    pages = cache.get(key)
+    if pages is None:
+        rows = (
+            Page.objects.filter(hidden=False)
+            .order_by("-date")
+            .values_list("page_title", "page_url", "content", "cover_image_url", "date")
+        )
+        pages = [
+            PageListing(
+                page_title,
+                page_url,
+                truncatewords(convert_to_markdown(content or ""), 60),
+                cover_image_url,
+                int(date.timestamp()) if date else "",
+            )
+            for page_title, page_url, content, cover_image_url, date in rows
+        ]
+        cache.set(key, pages, PAGE_TTL)
     return render(
         request,
         "misc/misc_pages.html",
@@ -0,0 +1,61 @@
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from proxy import sources
+from proxy.popularity import most_read
+
+
+class Command(BaseCommand):
+    help = "Re-fetch the most read proxy series before their cache entries expire"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", nargs="+", help="Reader prefixes to warm")
+        parser.add_argument("--top", type=int, default=settings.PROXY_WARMER["TOP"])
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=settings.PROXY_WARMER["INTERVAL"],
+            help="Seconds between passes; entries expiring before the next pass are refreshed",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=settings.PROXY_WARMER["PAUSE"],
+            help="Seconds to wait after each series that had to be fetched",
+        )
+        parser.add_argument(
+            "--loop", action="store_true", help="Keep warming every --interval seconds"
+        )
+
+    def handle(self, *args, **options):
+        selected = [
+            source
+            for source in sources
+            if not options["source"] or source.get_reader_prefix() in options["source"]
+        ]
+        while True:
+            started = monotonic()
+            for source in selected:
+                self.warm_source(source, options)
+            if not options["loop"]:
+                break
+            sleep(max(options["interval"] - (monotonic() - started), 0))
+
+    def warm_source(self, source, options):
+        prefix = source.get_reader_prefix()
+        warmed = 0
+        for meta_id in most_read(prefix, options["top"]):
+            try:
+                fetched = source.warm(meta_id, options["interval"])
+            except Exception as e:
+                self.stderr.write(f"{prefix}/{meta_id}: {e}")
+                fetched = True
+            if fetched:
+                warmed += 1
+                # Fetches are paced so warming never competes with readers
+                # for the upstream's rate limits.
+                sleep(options["pause"])
+        if warmed:
+            self.stdout.write(f"{prefix}: warmed {warmed} series")
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .source.timing import start_timings, stop_timings
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """Breaks proxy requests down into cache lookup, upstream fetch, parsing,
+    objectify, serialization and template rendering time, and reports it in a
+    Server-Timing header. A sample of slow requests is also logged with the
+    same breakdown. Only active when PROXY_SERVER_TIMING is enabled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROXY_SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = f"/{settings.PROXY_BASE_PATH}/"
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not request.path.startswith(self.prefix):
+            return self.get_response(request)
+        token, timings = start_timings()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not request.path.startswith(self.prefix):
+            return await self.get_response(request)
+        token, timings = start_timings()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        header = timings.header()
+        response["Server-Timing"] = header
+        if (
+            timings.total() >= settings.PROXY_SLOW_REQUEST_SECONDS
+            and random.random() < settings.PROXY_SLOW_REQUEST_SAMPLE_RATE
+        ):
+            logger.warning(f"Slow request {request.path}: {header}")
+        return response
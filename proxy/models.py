@@ -4,3 +4,6 @@ class HitCount(models.Model):
     proxy_type = models.CharField(max_length=64, blank=False, null=False)
     proxy_content = models.CharField(max_length=128, blank=False, null=False)
     hits = models.PositiveIntegerField(("Hits"), default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["proxy_type", "proxy_content"])]
@@ -0,0 +1,30 @@
+from django.db.models import Sum
+
+from reader.hit_buffer import HitBuffer, bulk_add_hits
+
+
+def _write_hits(pending):
+    from .models import HitCount
+
+    bulk_add_hits(HitCount, ("proxy_type", "proxy_content"), pending)
+
+
+proxy_hits = HitBuffer("proxy", _write_hits)
+
+
+def record_hit(proxy_type, proxy_content):
+    if len(proxy_content) <= 128:
+        proxy_hits.add((proxy_type, proxy_content))
+
+
+def most_read(proxy_type, limit):
+    """The proxy_content of the `limit` most read entries of a source."""
+    from .models import HitCount
+
+    return [
+        row["proxy_content"]
+        for row in HitCount.objects.filter(proxy_type=proxy_type)
+        .values("proxy_content")
+        .annotate(total=Sum("hits"))
+        .order_by("-total")[:limit]
+    ]
@@ -1,20 +1,53 @@
 import abc
+import asyncio
+import hashlib
 import json
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 
 import uwuify
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.urls import path, re_path
 from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
 from django.utils.html import conditional_escape
+from django.utils.http import quote_etag
+from ratelimit.exceptions import Ratelimited
+from ratelimit.utils import is_ratelimited
+from reader.users_cache_lib import get_user_ip
 
 from .data import *
 from .helpers import *
+from .metrics import in_context
+from .prefetch import prefetch
+from ..popularity import record_hit
+from .timing import phase
+
+
+def _chapter_number(chapter):
+    try:
+        return float(chapter)
+    except (TypeError, ValueError):
+        return None
 
 
 class ProxySource(metaclass=abc.ABCMeta):
+    # Set by sources that override the *_handler_async methods natively.
+    async_handlers = False
+    # Warm the next chapter's page list in the background while one is read.
+    prefetch_next_chapter = False
+    # The api_cache'd methods holding a series' data, innermost first, which
+    # the warm_proxy_cache command keeps fresh for the most read series.
+    warm_handlers = ("series_record", "series_api_handler", "series_page_handler")
+
     # /{PROXY_BASE_PATH}/:reader_prefix/slug
     @abc.abstractmethod
     def get_reader_prefix(self) -> str:
@@ -24,17 +57,23 @@ class ProxySource(metaclass=abc.ABCMeta):
     def shortcut_instantiator(self) -> List[re_path]:
         raise NotImplementedError
 
-    @abc.abstractmethod
-    def series_api_handler(self, meta_id: str) -> SeriesAPI:
+    def series_record(self, meta_id: str) -> Optional[SeriesRecord]:
+        """The canonical record the default handlers build their views from.
+        Sources implementing it should wrap it in api_cache, and it's then the
+        only thing cached for the series."""
         raise NotImplementedError
 
-    @abc.abstractmethod
+    def series_api_handler(self, meta_id: str) -> SeriesAPI:
+        record = self.series_record(meta_id)
+        return record and record.series_api()
+
     def chapter_api_handler(self, meta_id: str) -> ChapterAPI:
-        raise NotImplementedError
+        record = self.series_record(meta_id)
+        return record and record.chapter_api()
 
-    @abc.abstractmethod
     def series_page_handler(self, meta_id: str) -> SeriesPage:
-        raise NotImplementedError
+        record = self.series_record(meta_id)
+        return record and record.series_page()
 
     def uncache_duration(self) -> int:
         return 5
@@ -42,6 +81,9 @@ class ProxySource(metaclass=abc.ABCMeta):
     def cache_duration(self) -> int:
         return 60
 
+    def stale_duration(self) -> int:
+        return 600
+
     def wrap_chapter_meta(self, meta_id):
         return f"/{settings.PROXY_BASE_PATH}/api/{self.get_reader_prefix()}/chapter/{meta_id}/"
 
@@ -56,9 +98,66 @@ class ProxySource(metaclass=abc.ABCMeta):
 
     def _cached_response(self, request, request_func):
         duration = self.cache_duration()
-        return cache_control(public=True, max_age=duration, s_maxage=duration)(
-            request_func
-        )(request)
+        stale = self.stale_duration()
+        return cache_control(
+            public=True,
+            max_age=duration,
+            s_maxage=duration,
+            stale_while_revalidate=stale,
+            stale_if_error=stale,
+        )(request_func)(request)
+
+    def _conditional_response(self, request, request_func, *, etag=None):
+        """Cached response carrying the given ETag, which short-circuits to a
+        304 when the client's copy is still current."""
+        etag = quote_etag(etag) if etag else None
+
+        def conditional(request):
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = request_func(request)
+            if etag:
+                response["ETag"] = etag
+            return response
+
+        return self._cached_response(request, conditional)
+
+    def _html_etag(self, last_modified):
+        """Validator for a rendered page, which changes with the data and with
+        the static assets the page links to."""
+        if not last_modified:
+            return None
+        return hashlib.md5(
+            f"{last_modified}{settings.STATIC_VERSION}".encode("utf-8")
+        ).hexdigest()
+
+    def _json_response(self, request, data):
+        """Serves the pre-serialized body, compressed to match Accept-Encoding."""
+        with phase("serialize"):
+            data = data.prepared()
+        encoding = pick_encoding(
+            request.META.get("HTTP_ACCEPT_ENCODING", ""), data.bodies
+        )
+
+        def respond(request):
+            response = HttpResponse(
+                data.bodies[encoding], content_type="application/json"
+            )
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+            return response
+
+        response = self._conditional_response(
+            request,
+            respond,
+            etag=data.etag if encoding == "identity" else f"{data.etag}-{encoding}",
+        )
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    def _render(self, request, template, data):
+        with phase("render"):
+            return render(request, template, data)
 
     def _api_error(self, request):
         return self._uncached_response(
@@ -93,51 +192,154 @@ class ProxySource(metaclass=abc.ABCMeta):
             f"{settings.EXTERNAL_PROXY_URL}/v1/image/{encode(url)}?source=cubari_host"
         )
 
-    @cache_control(public=True, max_age=60, s_maxage=60)
-    def reader_view(self, request, meta_id, chapter, page=None):
-        if page:
-            try:
-                data = self.series_api_handler(meta_id)
-            except Exception as e:
-                return self._processing_error(request, e)
-            if data:
-                data = data.objectify()
-                if chapter.replace("-", ".") in data["chapters"]:
-                    data["version_query"] = settings.STATIC_VERSION
-                    data[
-                        "relative_url"
-                    ] = f"{settings.PROXY_BASE_PATH}/{self.get_reader_prefix()}/{meta_id}"
-                    data[
-                        "api_path"
-                    ] = f"/{settings.PROXY_BASE_PATH}/api/{self.get_reader_prefix()}/series/"
-                    data["image_proxy_url"] = settings.EXTERNAL_PROXY_URL
-                    data[
-                        "reader_modifier"
-                    ] = f"{settings.PROXY_BASE_PATH}/{self.get_reader_prefix()}"
-                    data["chapter_number"] = chapter.replace("-", ".")
-                    return self._cached_response(
-                        request,
-                        lambda request: render(request, "reader/reader.html", data),
+    async def series_api_handler_async(self, meta_id: str) -> SeriesAPI:
+        return await sync_to_async(self.series_api_handler, thread_sensitive=False)(
+            meta_id
+        )
+
+    async def chapter_api_handler_async(self, meta_id: str) -> ChapterAPI:
+        return await sync_to_async(
+            self.chapter_api_handler, thread_sensitive=False
+        )(meta_id)
+
+    async def series_page_handler_async(self, meta_id: str) -> SeriesPage:
+        return await sync_to_async(self.series_page_handler, thread_sensitive=False)(
+            meta_id
+        )
+
+    def _chapter_meta_id(self, url):
+        """The meta_id in a wrap_chapter_meta URL, or None for anything else."""
+        base = self.wrap_chapter_meta("")[:-1]
+        if isinstance(url, str) and url.startswith(base):
+            return url[len(base) :].rstrip("/")
+        return None
+
+    def next_chapter_meta_ids(self, data, chapter=None, chapter_meta_id=None):
+        """Meta ids of the chapter after `chapter` (or after whichever chapter
+        `chapter_meta_id` belongs to) in the series data, for the same groups."""
+        if chapter is None:
+            url = self.wrap_chapter_meta(chapter_meta_id)
+            chapter, groups = next(
+                (
+                    (
+                        number,
+                        [group for group, meta in entry.groups.items() if meta == url],
                     )
-            return self._api_error(request)
+                    for number, entry in data.chapters.items()
+                    if url in entry.groups.values()
+                ),
+                (None, ()),
+            )
+        elif chapter in data.chapters:
+            groups = list(data.chapters[chapter].groups)
         else:
-            return self._cached_response(
+            groups = ()
+        current = _chapter_number(chapter)
+        if not groups or current is None:
+            return []
+        # Chapters keyed by something other than a number have no place in
+        # the reading order, so they're never prefetched.
+        later = sorted(
+            (
+                number
+                for number in data.chapters
+                if _chapter_number(number) is not None and float(number) > current
+            ),
+            key=float,
+        )
+        meta_ids = []
+        for group in groups:
+            number = next((n for n in later if group in data.chapters[n].groups), None)
+            meta_id = number and self._chapter_meta_id(
+                data.chapters[number].groups[group]
+            )
+            if meta_id and meta_id not in meta_ids:
+                meta_ids.append(meta_id)
+        return meta_ids
+
+    def cached_series_api(self, meta_id: str) -> Optional[SeriesAPI]:
+        """The series data if it's already cached, without ever fetching it.
+        Sources whose series_api_handler isn't built on series_record override
+        it."""
+        peek = getattr(self.series_record, "peek", None)
+        record = peek(self, meta_id) if peek else None
+        return record and record.series_api()
+
+    def _prefetch_next(self, meta_id, chapter=None, chapter_meta_id=None):
+        """Queues a background warm-up of the next chapter's page list, read
+        off the series data. meta_id may come from the client, so the series
+        is only looked up in the cache, and nothing is warmed on a miss."""
+        if not self.prefetch_next_chapter or not meta_id:
+            return
+
+        def warm():
+            data = self.cached_series_api(meta_id)
+            if data:
+                for next_meta_id in self.next_chapter_meta_ids(
+                    data, chapter, chapter_meta_id
+                ):
+                    self.chapter_api_handler(next_meta_id)
+
+        prefetch((self.get_reader_prefix(), meta_id, chapter or chapter_meta_id), warm)
+
+    def warm(self, meta_id, within):
+        """Rebuilds the series' cache entries that would stop being fresh in
+        the next `within` seconds. Returns whether anything was fetched."""
+        warmed = False
+        for name in self.warm_handlers:
+            warm = getattr(getattr(self, name, None), "warm", None)
+            if warm and warm(self, meta_id, within):
+                warmed = True
+        return warmed
+
+    def serves_async(self):
+        """Sources that implement native async handlers are routed to the async
+        views when PROXY_ASYNC_VIEWS is enabled; everything else stays sync."""
+        return settings.PROXY_ASYNC_VIEWS and self.async_handlers
+
+    def _first_page_redirect(self, request, meta_id, chapter):
+        return self._cached_response(
+            request,
+            lambda request: redirect(
+                f"reader-{self.get_reader_prefix()}-chapter-page",
+                meta_id,
+                chapter,
+                "1",
+            ),
+        )
+
+    def _reader_response(self, request, meta_id, chapter, data):
+        if data and chapter.replace("-", ".") in data.chapters:
+            self._prefetch_next(meta_id, chapter=chapter.replace("-", "."))
+            last_modified = data.get_last_modified()
+            with phase("objectify"):
+                data = data.objectify()
+            data["version_query"] = settings.STATIC_VERSION
+            data[
+                "relative_url"
+            ] = f"{settings.PROXY_BASE_PATH}/{self.get_reader_prefix()}/{meta_id}"
+            data[
+                "api_path"
+            ] = f"/{settings.PROXY_BASE_PATH}/api/{self.get_reader_prefix()}/series/"
+            data["image_proxy_url"] = settings.EXTERNAL_PROXY_URL
+            data["chapter_batch_max"] = settings.PROXY_CHAPTER_BATCH_MAX
+            data[
+                "reader_modifier"
+            ] = f"{settings.PROXY_BASE_PATH}/{self.get_reader_prefix()}"
+            data["chapter_number"] = chapter.replace("-", ".")
+            return self._conditional_response(
                 request,
-                lambda request: redirect(
-                    f"reader-{self.get_reader_prefix()}-chapter-page",
-                    meta_id,
-                    chapter,
-                    "1",
-                ),
+                lambda request: self._render(request, "reader/reader.html", data),
+                etag=self._html_etag(last_modified),
             )
+        return self._api_error(request)
 
-    def series_view(self, request, meta_id):
-        try:
-            data = self.series_page_handler(meta_id)
-        except Exception as e:
-            return self._processing_error(request, e)
+    def _series_response(self, request, meta_id, data):
         if data:
-            data = data.objectify()
+            record_hit(self.get_reader_prefix(), meta_id)
+            last_modified = data.get_last_modified()
+            with phase("objectify"):
+                data = data.objectify()
             data["synopsis"] = self.process_description(data["synopsis"])
             data["version_query"] = settings.STATIC_VERSION
             data[
@@ -146,57 +348,232 @@ class ProxySource(metaclass=abc.ABCMeta):
             data[
                 "reader_modifier"
             ] = f"{settings.PROXY_BASE_PATH}/{self.get_reader_prefix()}"
-            return self._cached_response(
-                request, lambda request: render(request, "reader/series.html", data)
+            return self._conditional_response(
+                request,
+                lambda request: self._render(request, "reader/series.html", data),
+                etag=self._html_etag(last_modified),
             )
         else:
             return self._api_error(request)
 
+    def _series_api_response(self, request, meta_id, data):
+        if data:
+            record_hit(self.get_reader_prefix(), meta_id)
+        return self._api_response(request, data)
+
+    def _chapter_api_response(self, request, meta_id, data):
+        if data:
+            # The reader names the series it's reading from, since not every
+            # source's chapter data knows which series it belongs to.
+            self._prefetch_next(
+                request.headers.get("X-Cubari-Series") or data.series,
+                chapter_meta_id=meta_id,
+            )
+        return self._api_response(request, data)
+
+    def _api_response(self, request, data):
+        if data:
+            return self._json_response(request, data)
+        else:
+            return self._api_error(request)
+
+    @cache_control(public=True, max_age=60, s_maxage=60)
+    def reader_view(self, request, meta_id, chapter, page=None):
+        if not page:
+            return self._first_page_redirect(request, meta_id, chapter)
+        try:
+            data = self.series_api_handler(meta_id)
+        except Exception as e:
+            return self._processing_error(request, e)
+        return self._reader_response(request, meta_id, chapter, data)
+
+    def series_view(self, request, meta_id):
+        try:
+            data = self.series_page_handler(meta_id)
+        except Exception as e:
+            return self._processing_error(request, e)
+        return self._series_response(request, meta_id, data)
+
     def series_api_view(self, request, meta_id):
         try:
             data = self.series_api_handler(meta_id)
         except Exception as e:
             return self._processing_error(request, e)
-        if data:
-            data = data.objectify()
-            return self._cached_response(
-                request,
-                lambda request: HttpResponse(
-                    json.dumps(data), content_type="application/json"
-                ),
-            )
-        else:
-            return self._api_error(request)
+        return self._series_api_response(request, meta_id, data)
 
     def chapter_api_view(self, request, meta_id):
         try:
             data = self.chapter_api_handler(meta_id)
         except Exception as e:
             return self._processing_error(request, e)
-        if data:
-            data = data.objectify()
-            return self._cached_response(
-                request,
-                lambda request: HttpResponse(
-                    json.dumps(data["pages"]), content_type="application/json"
-                ),
-            )
+        return self._chapter_api_response(request, meta_id, data)
+
+    async def reader_view_async(self, request, meta_id, chapter, page=None):
+        if not page:
+            response = self._first_page_redirect(request, meta_id, chapter)
         else:
-            return self._api_error(request)
+            try:
+                data = await self.series_api_handler_async(meta_id)
+            except Exception as e:
+                response = self._processing_error(request, e)
+            else:
+                response = self._reader_response(request, meta_id, chapter, data)
+        # Mirrors the cache_control decorator on the sync reader_view.
+        patch_cache_control(response, public=True, max_age=60, s_maxage=60)
+        return response
+
+    async def series_view_async(self, request, meta_id):
+        try:
+            data = await self.series_page_handler_async(meta_id)
+        except Exception as e:
+            return self._processing_error(request, e)
+        return self._series_response(request, meta_id, data)
+
+    async def series_api_view_async(self, request, meta_id):
+        try:
+            data = await self.series_api_handler_async(meta_id)
+        except Exception as e:
+            return self._processing_error(request, e)
+        return self._series_api_response(request, meta_id, data)
+
+    async def chapter_api_view_async(self, request, meta_id):
+        try:
+            data = await self.chapter_api_handler_async(meta_id)
+        except Exception as e:
+            return self._processing_error(request, e)
+        return self._chapter_api_response(request, meta_id, data)
+
+    def _batch_meta_ids(self, request):
+        """The deduplicated chapter meta_ids posted as {"chapters": [...]}, or
+        None if the body isn't a valid batch."""
+        try:
+            meta_ids = json.loads(request.body)["chapters"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        if (
+            not isinstance(meta_ids, list)
+            or not 0 < len(meta_ids) <= settings.PROXY_CHAPTER_BATCH_MAX
+            or not all(isinstance(meta_id, str) for meta_id in meta_ids)
+        ):
+            return None
+        return list(dict.fromkeys(meta_ids))
+
+    @staticmethod
+    def _batch_ratelimited(request):
+        """Counts a batch request against its client's PROXY_CHAPTER_BATCH_RATE,
+        which is shared by every source."""
+        return is_ratelimited(
+            request,
+            group="proxy_chapter_batch",
+            key=lambda group, request: get_user_ip(request),
+            rate=settings.PROXY_CHAPTER_BATCH_RATE,
+            method="POST",
+            increment=True,
+        )
+
+    def _chapter_body(self, meta_id):
+        """The serialized page list for one chapter of a batch, None on failure."""
+        try:
+            data = self.chapter_api_handler(meta_id)
+        except Exception:
+            return None
+        return data and data.prepared().bodies["identity"]
+
+    async def _chapter_body_async(self, meta_id, semaphore):
+        async with semaphore:
+            try:
+                data = await self.chapter_api_handler_async(meta_id)
+            except Exception:
+                return None
+        return data and data.prepared().bodies["identity"]
+
+    def _chapter_batch_bodies(self, meta_ids):
+        """Yields (meta_id, body) pairs as the chapters resolve, at most
+        PROXY_CHAPTER_BATCH_WORKERS at a time."""
+        executor = ThreadPoolExecutor(
+            max_workers=settings.PROXY_CHAPTER_BATCH_WORKERS,
+            thread_name_prefix="chapter_batch",
+        )
+        try:
+            futures = {
+                executor.submit(in_context(self._chapter_body), meta_id): meta_id
+                for meta_id in meta_ids
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Don't keep fetching for a client that went away.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _chapter_batch_json(results):
+        """Writes {meta_id: pages} as one JSON object, a member at a time.
+        Chapters that couldn't be loaded are null."""
+        yield b"{"
+        for index, (meta_id, body) in enumerate(results):
+            yield b"%s%s:%s" % (
+                b"," if index else b"",
+                json.dumps(meta_id).encode(),
+                body or b"null",
+            )
+        yield b"}"
+
+    @csrf_exempt
+    def chapter_batch_view(self, request):
+        if self._batch_ratelimited(request):
+            raise Ratelimited()
+        meta_ids = self._batch_meta_ids(request)
+        if meta_ids is None:
+            return HttpResponseBadRequest("Expected a JSON list of chapters.")
+        return StreamingHttpResponse(
+            self._chapter_batch_json(self._chapter_batch_bodies(meta_ids)),
+            content_type="application/json",
+        )
+
+    async def chapter_batch_view_async(self, request):
+        # Django can't stream from a coroutine yet, so the async view gathers
+        # the batch and responds in one go instead.
+        if await off_loop(self._batch_ratelimited)(request):
+            raise Ratelimited()
+        meta_ids = self._batch_meta_ids(request)
+        if meta_ids is None:
+            return HttpResponseBadRequest("Expected a JSON list of chapters.")
+        semaphore = asyncio.Semaphore(settings.PROXY_CHAPTER_BATCH_WORKERS)
+        bodies = await asyncio.gather(
+            *(self._chapter_body_async(meta_id, semaphore) for meta_id in meta_ids)
+        )
+        return HttpResponse(
+            b"".join(self._chapter_batch_json(zip(meta_ids, bodies))),
+            content_type="application/json",
+        )
+
+    # csrf_exempt's wrapper would hide that the view is a coroutine.
+    chapter_batch_view_async.csrf_exempt = True
 
     def register_api_routes(self):
         """Routes will be under /{settings.PROXY_BASE_PATH}/api/<route>"""
         return [
             path(
                 f"{self.get_reader_prefix()}/series/<str:meta_id>/",
-                self.series_api_view,
+                self.series_api_view_async
+                if self.serves_async()
+                else self.series_api_view,
                 name=f"api-{self.get_reader_prefix()}-series-data",
             ),
             path(
                 f"{self.get_reader_prefix()}/chapter/<str:meta_id>/",
-                self.chapter_api_view,
+                self.chapter_api_view_async
+                if self.serves_async()
+                else self.chapter_api_view,
                 name=f"api-{self.get_reader_prefix()}-chapter-data",
             ),
+            path(
+                f"{self.get_reader_prefix()}/chapters/",
+                self.chapter_batch_view_async
+                if self.serves_async()
+                else self.chapter_batch_view,
+                name=f"api-{self.get_reader_prefix()}-chapter-batch",
+            ),
         ]
 
     def register_shortcut_routes(self):
@@ -206,17 +583,17 @@ class ProxySource(metaclass=abc.ABCMeta):
         return [
             path(
                 f"{self.get_reader_prefix()}/<str:meta_id>/",
-                self.series_view,
+                self.series_view_async if self.serves_async() else self.series_view,
                 name=f"reader-{self.get_reader_prefix()}-series-page",
             ),
             path(
                 f"{self.get_reader_prefix()}/<str:meta_id>/<str:chapter>/",
-                self.reader_view,
+                self.reader_view_async if self.serves_async() else self.reader_view,
                 name=f"reader-{self.get_reader_prefix()}-chapter",
             ),
             path(
                 f"{self.get_reader_prefix()}/<str:meta_id>/<str:chapter>/<str:page>/",
-                self.reader_view,
+                self.reader_view_async if self.serves_async() else self.reader_view,
                 name=f"reader-{self.get_reader_prefix()}-chapter-page",
             ),
         ]
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import weakref
+from time import monotonic
+from urllib.parse import urlparse
+
+import aiohttp
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+
+from .breaker import CircuitBreaker
+from .bulkhead import Bulkhead
+from .data import ProxyException
+from .helpers import GLOBAL_HEADERS, REQUEST_TIMEOUT, off_loop, proxied_url
+from .metrics import record_upstream
+
+# One aiohttp session per event loop; sessions can't be shared across loops.
+_sessions = weakref.WeakKeyDictionary()
+
+
+class AsyncResponse:
+    """The subset of requests.Response that the source handlers rely on, so
+    parsing code can be shared between the sync and async paths."""
+
+    def __init__(self, status_code, headers, content, url, encoding=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def get_async_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=settings.PROXY_ASYNC_CONNECTION_LIMIT, ttl_dns_cache=300
+            ),
+            # Shared by every request on the loop, so never keep upstream cookies.
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        )
+    return session
+
+
+async def async_sensored_request_handler(method, request_url, original_url, **kwargs):
+    hostname = urlparse(original_url).hostname
+    # The cluster-wide bulkhead and the breaker's state live in the cache.
+    bulkhead = Bulkhead(hostname)
+    await off_loop(bulkhead.acquire)()
+    try:
+        breaker = CircuitBreaker(hostname)
+        probe = await off_loop(breaker.before_request)()
+
+        started = monotonic()
+        try:
+            async with get_async_session().request(
+                method, request_url, **kwargs
+            ) as resp:
+                resp = AsyncResponse(
+                    resp.status,
+                    CaseInsensitiveDict(resp.headers),
+                    await resp.read(),
+                    str(resp.url),
+                    resp.charset,
+                )
+        except asyncio.TimeoutError:
+            record_upstream(hostname, started, "timeout")
+            await off_loop(breaker.record_failure)(probe)
+            raise ProxyException("Downstream server timed out. Please try again.")
+        except aiohttp.ClientConnectionError:
+            record_upstream(hostname, started, "connection_error")
+            await off_loop(breaker.record_failure)(probe)
+            raise ProxyException("Couldn't connect to the downstream server.")
+        record_upstream(hostname, started, resp.status_code)
+    finally:
+        await off_loop(bulkhead.release)()
+
+    if resp.status_code >= 500:
+        await off_loop(breaker.record_failure)(probe)
+    else:
+        await off_loop(breaker.record_success)(probe)
+    return resp
+
+
+async def async_get_wrapper(
+    url, *, headers={}, use_proxy=False, secondary=False, **kwargs
+):
+    return await async_sensored_request_handler(
+        "GET",
+        proxied_url(url, use_proxy=use_proxy, secondary=secondary),
+        url,
+        headers={**GLOBAL_HEADERS, **headers},
+        **kwargs,
+    )
+
+
+async def async_post_wrapper(url, headers={}, use_proxy=False, **kwargs):
+    return await async_sensored_request_handler(
+        "POST",
+        proxied_url(url, use_proxy=use_proxy),
+        url,
+        headers={**GLOBAL_HEADERS, **headers},
+        **kwargs,
+    )
@@ -0,0 +1,138 @@
+import threading
+from time import time as unix_time
+
+from django.core.cache import cache
+
+from .data import ProxyBusyException
+from .metrics import record_rejected
+
+BREAKER_PREFIX = "breaker/"
+BREAKER_HOSTS_KEY = f"{BREAKER_PREFIX}hosts"
+BREAKER_WINDOW = 5 * 60  # Failures are counted over a sliding 5 minute window,
+BREAKER_BUCKET = 30  # made up of 30 second buckets.
+BREAKER_MAX_FAILURES = 25  # 25 failures within the window? Open the circuit.
+BREAKER_COOLDOWN = 60  # First cooldown before a probe is let through,
+BREAKER_MAX_COOLDOWN = 10 * 60  # doubling on every failed probe up to 10 minutes.
+BREAKER_PROBE_TTL = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def _incr(key, ttl):
+    cache.add(key, 0, ttl)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The bucket expired between the add and the incr.
+        cache.set(key, 1, ttl)
+        return 1
+
+
+class CircuitBreaker:
+    """Per-hostname circuit breaker shared across workers through the cache.
+
+    Closed: requests flow and failures are counted in time buckets with
+    cache.incr. Open: requests fail fast until the cooldown runs out.
+    Half-open: exactly one probe request is let through; if it succeeds the
+    circuit closes, otherwise it re-opens with a longer cooldown.
+    """
+
+    _known_hosts = set()
+    _known_hosts_lock = threading.Lock()
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.state_key = f"{BREAKER_PREFIX}{hostname}/state"
+        self.probe_key = f"{BREAKER_PREFIX}{hostname}/probe"
+
+    def _bucket_key(self, bucket):
+        return f"{BREAKER_PREFIX}{self.hostname}/failures/{bucket}"
+
+    def _window_keys(self):
+        current = int(unix_time() // BREAKER_BUCKET)
+        return [
+            self._bucket_key(bucket)
+            for bucket in range(
+                current - BREAKER_WINDOW // BREAKER_BUCKET + 1, current + 1
+            )
+        ]
+
+    def failures(self):
+        return sum(cache.get_many(self._window_keys()).values())
+
+    def state(self):
+        """Returns the current state, along with the open circuit's metadata."""
+        circuit = cache.get(self.state_key)
+        if circuit is None:
+            return CLOSED, None
+        if unix_time() < circuit["retry_at"]:
+            return OPEN, circuit
+        return HALF_OPEN, circuit
+
+    def before_request(self):
+        """Raises if the circuit is open; returns True if this call is the probe."""
+        state, circuit = self.state()
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and cache.add(self.probe_key, 1, BREAKER_PROBE_TTL):
+            return True
+        record_rejected(self.hostname, "circuit_open")
+        retry_in = max(int(circuit["retry_at"] - unix_time()), BREAKER_BUCKET)
+        raise ProxyBusyException(
+            f"This proxy has temporarily been disabled due to service degradation. Please try again in {retry_in // 60 or 1} minute(s)."
+        )
+
+    def record_success(self, probe):
+        if probe:
+            cache.delete_many([self.state_key, self.probe_key, *self._window_keys()])
+
+    def record_failure(self, probe):
+        self._register()
+        if probe:
+            circuit = cache.get(self.state_key) or {}
+            self._open(min(circuit.get("cooldown", 0) * 2, BREAKER_MAX_COOLDOWN))
+            cache.delete(self.probe_key)
+            return
+        current = int(unix_time() // BREAKER_BUCKET)
+        _incr(self._bucket_key(current), BREAKER_WINDOW + BREAKER_BUCKET)
+        if self.failures() >= BREAKER_MAX_FAILURES:
+            # Only the first worker to trip the breaker gets to open it.
+            self._open(BREAKER_COOLDOWN, replace=False)
+
+    def _open(self, cooldown, replace=True):
+        cooldown = max(cooldown, BREAKER_COOLDOWN)
+        circuit = {"retry_at": unix_time() + cooldown, "cooldown": cooldown}
+        store = cache.set if replace else cache.add
+        store(self.state_key, circuit, BREAKER_MAX_COOLDOWN * 2)
+
+    def _register(self):
+        # Memcached can't list keys, so keep a best-effort registry of the
+        # hosts that have failed for the admin page to report on.
+        if self.hostname in self._known_hosts:
+            return
+        with self._known_hosts_lock:
+            self._known_hosts.add(self.hostname)
+        hosts = cache.get(BREAKER_HOSTS_KEY) or set()
+        if self.hostname not in hosts:
+            hosts.add(self.hostname)
+            cache.set(BREAKER_HOSTS_KEY, hosts, None)
+
+
+def breaker_states():
+    states = []
+    for hostname in sorted(cache.get(BREAKER_HOSTS_KEY) or ()):
+        breaker = CircuitBreaker(hostname)
+        state, circuit = breaker.state()
+        states.append(
+            {
+                "hostname": hostname,
+                "state": state,
+                "failures": breaker.failures(),
+                "retry_in": max(int(circuit["retry_at"] - unix_time()), 0)
+                if circuit
+                else 0,
+            }
+        )
+    return states
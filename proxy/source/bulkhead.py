@@ -0,0 +1,124 @@
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .data import ProxyBusyException
+from .metrics import record_rejected
+
+BULKHEAD_PREFIX = "bulkhead/"
+# Cluster-wide counters expire on their own so slots held by a worker that
+# died mid-request are eventually given back.
+BULKHEAD_CLUSTER_TTL = 60
+
+_in_flight = {}
+_rejected = {}
+_lock = threading.Lock()
+
+
+def reset_bulkheads():
+    """Forked children start with nothing in flight."""
+    global _lock
+    _in_flight.clear()
+    _rejected.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_bulkheads)
+
+
+def _limit(hostname):
+    limits = settings.PROXY_BULKHEADS
+    return limits.get(hostname, limits["default"])
+
+
+def _reject(hostname):
+    with _lock:
+        _rejected[hostname] = _rejected.get(hostname, 0) + 1
+    record_rejected(hostname, "shed")
+    raise ProxyBusyException(
+        "Too many requests to this source are already in progress. Please try again shortly."
+    )
+
+
+class Bulkhead:
+    """Caps the in-flight requests to one upstream hostname, so a slow host
+    can only tie up its own share of the worker's threads.
+
+    The cap is per process, with an optional cluster-wide cap shared through
+    the cache for hosts listed in PROXY_CLUSTER_BULKHEADS. Requests over
+    either cap fail fast with a ProxyBusyException rather than queueing.
+    """
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.limit = _limit(hostname)
+        self.cluster_limit = settings.PROXY_CLUSTER_BULKHEADS.get(hostname)
+        self.cluster_key = f"{BULKHEAD_PREFIX}{hostname}"
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        with _lock:
+            in_flight = _in_flight.get(self.hostname, 0)
+            admitted = in_flight < self.limit
+            if admitted:
+                _in_flight[self.hostname] = in_flight + 1
+        if not admitted:
+            _reject(self.hostname)
+        if self.cluster_limit and self._cluster_incr() > self.cluster_limit:
+            self.release()
+            _reject(self.hostname)
+
+    def release(self):
+        with _lock:
+            _in_flight[self.hostname] = max(_in_flight.get(self.hostname, 0) - 1, 0)
+        if self.cluster_limit:
+            try:
+                cache.decr(self.cluster_key)
+            except ValueError:
+                # The counter expired while the request was in flight.
+                pass
+
+    def _cluster_incr(self):
+        cache.add(self.cluster_key, 0, BULKHEAD_CLUSTER_TTL)
+        try:
+            return cache.incr(self.cluster_key)
+        except ValueError:
+            cache.set(self.cluster_key, 1, BULKHEAD_CLUSTER_TTL)
+            return 1
+
+    def cluster_in_flight(self):
+        if not self.cluster_limit:
+            return None
+        return max(cache.get(self.cluster_key) or 0, 0)
+
+
+def bulkhead_states():
+    """Occupancy of every host this worker has requested, plus any host with
+    a cluster-wide cap."""
+    with _lock:
+        in_flight = dict(_in_flight)
+        rejected = dict(_rejected)
+    states = []
+    for hostname in sorted(
+        {*in_flight, *settings.PROXY_CLUSTER_BULKHEADS}, key=lambda host: host or ""
+    ):
+        bulkhead = Bulkhead(hostname)
+        states.append(
+            {
+                "hostname": hostname,
+                "in_flight": in_flight.get(hostname, 0),
+                "limit": bulkhead.limit,
+                "rejected": rejected.get(hostname, 0),
+                "cluster_in_flight": bulkhead.cluster_in_flight(),
+                "cluster_limit": bulkhead.cluster_limit,
+            }
+        )
+    return states
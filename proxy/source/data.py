@@ -1,58 +1,709 @@
-class SeriesAPI:
-    def __init__(self, **kwargs):
-        self.args = kwargs
+import gzip
+import hashlib
+import json
+import sys
+from datetime import datetime, timezone
+from json.encoder import encode_basestring_ascii
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this aren't worth the compression overhead.
+COMPRESS_MIN_LENGTH = 512
+
+_ENCODERS = {"gzip": lambda body: gzip.compress(body, compresslevel=6, mtime=0)}
+_DECODERS = {"gzip": gzip.decompress}
+if brotli:
+    _ENCODERS["br"] = lambda body: brotli.compress(body, quality=5)
+    _DECODERS["br"] = brotli.decompress
+
+
+class Bodies(dict):
+    """A response body per content coding. Only the smallest copy is pickled,
+    so a large series stays well under memcached's item size limit; the other
+    codings are listed but rebuilt from it the first time they're served."""
+
+    def __getitem__(self, coding):
+        body = super().__getitem__(coding)
+        if body is None:
+            identity = super().get("identity")
+            if identity is None:
+                kept, compressed = next(
+                    (kept, stored) for kept, stored in self.items() if stored
+                )
+                identity = _DECODERS[kept](compressed)
+                super().__setitem__("identity", identity)
+            body = identity if coding == "identity" else _ENCODERS[coding](identity)
+            super().__setitem__(coding, body)
+        return body
+
+    def __reduce__(self):
+        kept = next(coding for coding in ("br", "gzip", "identity") if coding in self)
+        return _unpickle_bodies, (kept, self[kept], tuple(self))
+
+
+def _unpickle_bodies(kept, body, codings):
+    bodies = Bodies.fromkeys(codings)
+    bodies[kept] = body
+    return bodies
+
+
+def _parse_timestamp(value):
+    """Best-effort conversion of the chapter date formats sources emit into a
+    unix timestamp: epoch seconds/milliseconds, the reader's [Y, M - 1, D, h,
+    m, s] lists, or ISO dates."""
+    try:
+        if isinstance(value, list) and len(value) == 6:
+            year, month, day, hour, minute, second = (int(v) for v in value)
+            return datetime(
+                year, month + 1, day, hour, minute, second, tzinfo=timezone.utc
+            ).timestamp()
+        if isinstance(value, str) and "-" in value:
+            date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc)
+            return date.timestamp()
+        timestamp = float(value)
+    except (TypeError, ValueError):
+        return None
+    # Some sources hand us milliseconds.
+    return timestamp / 1000 if timestamp > 1e11 else timestamp
+
+
+def _latest_timestamp(values):
+    timestamps = [ts for ts in map(_parse_timestamp, values) if ts]
+    return int(max(timestamps)) if timestamps else None
+
+
+_encode = json.JSONEncoder().encode
+# Scalars skip the encoder's setup; it's the bulk of what chapters contain.
+_encode_scalar = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    type(None): lambda value: "null",
+}
+
+
+def _write_json(out, value):
+    encode = _encode_scalar.get(type(value))
+    if encode is not None:
+        out.append(encode(value))
+        return
+    write_json = getattr(value, "write_json", None)
+    if write_json is None:
+        out.append(_encode(value))
+    else:
+        write_json(out)
+
+
+def _write_object(out, items):
+    """Appends the JSON for a sequence of (key, value) pairs to out, letting
+    records write themselves so no intermediate dicts are built."""
+    out.append("{")
+    for index, (key, value) in enumerate(items):
+        if index:
+            out.append(", ")
+        out.append(encode_basestring_ascii(str(key)))
+        out.append(": ")
+        _write_json(out, value)
+    out.append("}")
+
+
+def _intern(key):
+    return sys.intern(key) if isinstance(key, str) else key
+
+
+# Per-chapter maps are keyed by the same handful of group ids over and over,
+# so their key tuples are shared; pickle then writes each one only once.
+_shared_keys = {}
+SHARED_KEYS_MAX = 4096
+
+
+def _share_keys(keys):
+    shared = _shared_keys.get(keys)
+    if shared is None:
+        if len(_shared_keys) >= SHARED_KEYS_MAX:
+            return keys
+        shared = _shared_keys.setdefault(keys, keys)
+    return shared
+
+
+def _compact(value):
+    # Page lists become tuples; everything else is stored as given.
+    return tuple(value) if isinstance(value, list) else value
+
+
+# Maps with more keys than this build a dict index on their first lookup
+# rather than scanning their keys.
+INDEXED_MAP_MIN = 8
+
+
+class FrozenMap:
+    """Read-only mapping stored as parallel tuples of interned keys and values,
+    for the group names and each chapter's per-group links and dates, where a
+    dict per entry is a lot of overhead."""
+
+    __slots__ = ("_keys", "_values", "_index")
+
+    def __init__(self, keys=(), values=()):
+        self._keys = keys
+        self._values = values
+        self._index = None
+
+    @classmethod
+    def from_value(cls, value, share_keys=False):
+        if isinstance(value, cls):
+            return value
+        keys = tuple(_intern(key) for key in value.keys())
+        return cls(
+            _share_keys(keys) if share_keys else keys,
+            tuple(_compact(item) for item in value.values()),
+        )
+
+    def __reduce__(self):
+        return FrozenMap, (self._keys, self._values)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def _positions(self):
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(self._keys)}
+        return self._index
+
+    def __contains__(self, key):
+        if len(self._keys) > INDEXED_MAP_MIN:
+            return key in self._positions()
+        return key in self._keys
+
+    def __getitem__(self, key):
+        if len(self._keys) > INDEXED_MAP_MIN:
+            return self._values[self._positions()[key]]
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def to_dict(self):
+        return {
+            key: value.to_dict() if hasattr(value, "to_dict") else value
+            for key, value in self.items()
+        }
+
+    def write_json(self, out):
+        _write_object(out, self.items())
+
+
+class Chapter:
+    """A series' entry for one chapter. Keys other than the ones every source
+    emits are kept, in order, in the `extra` map. So are optional keys that a
+    source set to null, so they're still written out as null."""
+
+    __slots__ = ("volume", "title", "groups", "release_date", "last_updated", "extra")
+
+    def __init__(
+        self, volume, title, groups, release_date=None, last_updated=None, extra=None
+    ):
+        self.volume = volume
+        self.title = title
+        self.groups = groups
+        self.release_date = release_date
+        self.last_updated = last_updated
+        self.extra = extra or FrozenMap()
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, cls):
+            return value
+        release_date = value.get("release_date")
+        return cls(
+            value["volume"],
+            value["title"],
+            FrozenMap.from_value(value["groups"], share_keys=True),
+            FrozenMap.from_value(release_date, share_keys=True)
+            if release_date is not None
+            else None,
+            value.get("last_updated"),
+            FrozenMap.from_value(
+                {
+                    key: item
+                    for key, item in value.items()
+                    if key not in cls.__slots__
+                    or (item is None and key in ("release_date", "last_updated"))
+                },
+                share_keys=True,
+            ),
+        )
+
+    def __reduce__(self):
+        state = []
+        self.flatten_into(state)
+        return _chapter, (tuple(state),)
+
+    def flatten_into(self, state):
+        state.extend((self.volume, self.title, self.groups.keys()))
+        state.extend(self.groups.values())
+        if self.release_date is None:
+            state.append(None)
+        else:
+            state.append(self.release_date.keys())
+            state.extend(self.release_date.values())
+        state.extend((self.last_updated, self.extra.keys()))
+        state.extend(self.extra.values())
+
+    @classmethod
+    def unflatten(cls, state, index):
+        """Rebuilds a chapter written by flatten_into, starting at state[index];
+        returns it along with the index after it."""
+        volume, title, group_ids = state[index : index + 3]
+        index += 3
+        groups = FrozenMap(
+            _share_keys(group_ids), state[index : index + len(group_ids)]
+        )
+        index += len(group_ids)
+        release_ids = state[index]
+        index += 1
+        release_date = None
+        if release_ids is not None:
+            release_date = FrozenMap(
+                _share_keys(release_ids), state[index : index + len(release_ids)]
+            )
+            index += len(release_ids)
+        last_updated, extra_keys = state[index : index + 2]
+        index += 2
+        extra = FrozenMap(
+            _share_keys(extra_keys), state[index : index + len(extra_keys)]
+        )
+        index += len(extra_keys)
+        return cls(volume, title, groups, release_date, last_updated, extra), index
+
+    def items(self):
+        yield "volume", self.volume
+        yield "title", self.title
+        yield "groups", self.groups
+        if self.release_date is not None:
+            yield "release_date", self.release_date
+        if self.last_updated is not None:
+            yield "last_updated", self.last_updated
+        yield from self.extra.items()
+
+    def to_dict(self):
+        return {
+            key: value.to_dict() if isinstance(value, FrozenMap) else value
+            for key, value in self.items()
+        }
+
+    def write_json(self, out):
+        # Spelled out rather than going through items(), since a series can
+        # have thousands of these.
+        out.append('{"volume": ')
+        _write_json(out, self.volume)
+        out.append(', "title": ')
+        _write_json(out, self.title)
+        out.append(', "groups": ')
+        self.groups.write_json(out)
+        if self.release_date is not None:
+            out.append(', "release_date": ')
+            self.release_date.write_json(out)
+        if self.last_updated is not None:
+            out.append(', "last_updated": ')
+            _write_json(out, self.last_updated)
+        for key, value in self.extra.items():
+            out.append(", ")
+            out.append(encode_basestring_ascii(str(key)))
+            out.append(": ")
+            _write_json(out, value)
+        out.append("}")
+
+
+class ChapterMap(FrozenMap):
+    """A series' chapters, each of which pickles itself as one flat tuple."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, cls):
+            return value
+        return cls(
+            tuple(_intern(key) for key in value.keys()),
+            tuple(Chapter.from_value(chapter) for chapter in value.values()),
+        )
+
+    def __reduce__(self):
+        return ChapterMap, (self._keys, self._values)
+
+
+def _chapter(state):
+    return Chapter.unflatten(state, 0)[0]
+
+
+class ProxyData:
+    """The response body (and its compressed variants) and validators are
+    computed once, by api_cache, before the value is stored, so requests can
+    be answered without serializing anything."""
+
+    __slots__ = ("etag", "last_modified", "bodies")
+
+    # Whether the data is ever served as JSON, rather than only rendered.
+    json_body = True
+
+    def __init__(self):
+        self.etag = None
+        self.last_modified = None
+        self.bodies = None
+
+    def items(self):
+        return self.objectify().items()
+
+    def payload(self):
+        return self.objectify()
+
+    def serialize(self):
+        out = []
+        _write_json(out, self.payload())
+        return "".join(out).encode("utf-8")
+
+    def write_json(self, out):
+        _write_object(out, self.items())
+
+    def newest_timestamp(self):
+        return None
+
+    def prepare(self):
+        self.last_modified = self.newest_timestamp()
+        if not self.json_body:
+            self.bodies = {}
+            return self
+        body = self.serialize()
+        self.bodies = Bodies(identity=body)
+        if len(body) >= COMPRESS_MIN_LENGTH:
+            for coding, encode in _ENCODERS.items():
+                self.bodies[coding] = encode(body)
+        self.etag = hashlib.sha1(body).hexdigest()
+        return self
+
+    def prepared(self):
+        # Handlers that bypass api_cache hand us values that were never prepared.
+        return self if self.bodies is not None else self.prepare()
+
+    def get_last_modified(self):
+        """The newest timestamp in the data, without preparing the bodies."""
+        if self.bodies is None and self.last_modified is None:
+            self.last_modified = self.newest_timestamp()
+        return self.last_modified
+
+
+class SeriesAPI(ProxyData):
+    __slots__ = (
+        "slug",
+        "title",
+        "description",
+        "author",
+        "artist",
+        "groups",
+        "cover",
+        "chapters",
+    )
+
+    def __init__(
+        self, *, slug, title, description, author, artist, groups, cover, chapters
+    ):
+        super().__init__()
+        self.slug = slug
+        self.title = title
+        self.description = description
+        self.author = author
+        self.artist = artist
+        self.groups = FrozenMap.from_value(groups)
+        self.cover = cover
+        self.chapters = ChapterMap.from_value(chapters)
+
+    def items(self):
+        yield "slug", self.slug
+        yield "title", self.title
+        yield "description", self.description
+        yield "author", self.author
+        yield "artist", self.artist
+        yield "groups", self.groups
+        yield "cover", self.cover
+        yield "chapters", self.chapters
+        yield "series_name", self.title
 
     def objectify(self):
         return {
-            "slug": self.args["slug"],
-            "title": self.args["title"],
-            "description": self.args["description"],
-            "author": self.args["author"],
-            "artist": self.args["artist"],
-            "groups": self.args["groups"],
-            "cover": self.args["cover"],
-            "chapters": self.args["chapters"],
-            "series_name": self.args["title"],
+            key: value.to_dict() if isinstance(value, FrozenMap) else value
+            for key, value in self.items()
         }
 
+    def payload(self):
+        return self
+
+    def newest_timestamp(self):
+        return _latest_timestamp(
+            date
+            for chapter in self.chapters.values()
+            for date in [
+                *(chapter.release_date.values() if chapter.release_date else ()),
+                chapter.last_updated,
+            ]
+        )
+
 
-class SeriesPage:
-    def __init__(self, **kwargs):
-        self.args = kwargs
+class SeriesPage(ProxyData):
+    __slots__ = (
+        "series",
+        "alt_titles",
+        "alt_titles_str",
+        "slug",
+        "cover_vol_url",
+        "metadata",
+        "synopsis",
+        "author",
+        "chapter_list",
+        "original_url",
+    )
+    json_body = False
+
+    def __init__(
+        self,
+        *,
+        series,
+        alt_titles,
+        alt_titles_str,
+        slug,
+        cover_vol_url,
+        metadata,
+        synopsis,
+        author,
+        chapter_list,
+        original_url,
+    ):
+        super().__init__()
+        self.series = series
+        self.alt_titles = tuple(alt_titles)
+        self.alt_titles_str = alt_titles_str
+        self.slug = slug
+        self.cover_vol_url = cover_vol_url
+        self.metadata = tuple(map(tuple, metadata or ()))
+        self.synopsis = synopsis
+        self.author = author
+        self.chapter_list = tuple(map(tuple, chapter_list))
+        self.original_url = original_url
 
     def objectify(self):
         return {
-            "series": self.args["series"],
-            "alt_titles": self.args["alt_titles"],
-            "alt_titles_str": self.args["alt_titles_str"],
-            "slug": self.args["slug"],
-            "cover_vol_url": self.args["cover_vol_url"],
-            "metadata": self.args["metadata"],
-            "synopsis": self.args["synopsis"],
-            "author": self.args["author"],
-            "chapter_list": self.args["chapter_list"],
-            "original_url": self.args["original_url"],
+            "series": self.series,
+            "alt_titles": self.alt_titles,
+            "alt_titles_str": self.alt_titles_str,
+            "slug": self.slug,
+            "cover_vol_url": self.cover_vol_url,
+            "metadata": self.metadata,
+            "synopsis": self.synopsis,
+            "author": self.author,
+            "chapter_list": self.chapter_list,
+            "original_url": self.original_url,
             "available_features": ["detailed"],
         }
 
+    def newest_timestamp(self):
+        return _latest_timestamp(chapter[5] for chapter in self.chapter_list)
+
+
+class ChapterAPI(ProxyData):
+    __slots__ = ("series", "pages", "chapter")
+
+    def __init__(self, *, series, pages, chapter):
+        super().__init__()
+        self.series = series
+        self.pages = tuple(pages)
+        self.chapter = chapter
+
+    def objectify(self):
+        return {
+            "series": self.series,
+            "pages": self.pages,
+            "chapter": self.chapter,
+        }
+
+    def payload(self):
+        return self.pages
+
+
+class SeriesRecord(ProxyData):
+    """The normalized result of fetching a series, and the only thing a source
+    needs to cache for it. The SeriesAPI, SeriesPage and (for single-album
+    sources) ChapterAPI views are derived from it on request, and memoized on
+    the instance. The SeriesAPI view's bodies are the costly ones to build, so
+    preparing the record prepares that view too, and it's pickled along with
+    the record (keeping just one of its bodies); the others are cheap to
+    rebuild after unpickling."""
+
+    __slots__ = (
+        "slug",
+        "title",
+        "description",
+        "author",
+        "artist",
+        "cover",
+        "groups",
+        "chapter_dict",
+        "chapter_list",
+        "pages_list",
+        "original_url",
+        "alt_titles",
+        "alt_titles_str",
+        "metadata",
+        "_views",
+    )
+    json_body = False
+
+    def __init__(
+        self,
+        *,
+        slug,
+        title,
+        description,
+        author,
+        artist,
+        cover,
+        groups,
+        chapter_dict,
+        chapter_list=(),
+        pages_list=None,
+        original_url=None,
+        alt_titles=(),
+        alt_titles_str=None,
+        metadata=(),
+    ):
+        super().__init__()
+        self.slug = slug
+        self.title = title
+        self.description = description
+        self.author = author
+        self.artist = artist
+        self.cover = cover
+        self.groups = FrozenMap.from_value(groups)
+        self.chapter_dict = ChapterMap.from_value(chapter_dict)
+        self.chapter_list = tuple(map(tuple, chapter_list))
+        self.pages_list = None if pages_list is None else tuple(pages_list)
+        self.original_url = original_url
+        self.alt_titles = tuple(alt_titles)
+        self.alt_titles_str = alt_titles_str
+        self.metadata = tuple(map(tuple, metadata or ()))
+        self._views = {}
+
+    def __getstate__(self):
+        state = {
+            slot: getattr(self, slot)
+            for cls in type(self).__mro__
+            for slot in getattr(cls, "__slots__", ())
+            if slot != "_views"
+        }
+        series_api = self._views.get("series_api")
+        if series_api is not None and series_api.bodies is not None:
+            # Shares the groups and chapters with the record in the pickle.
+            state["_views"] = {"series_api": series_api}
+        return state
+
+    def __setstate__(self, state):
+        self._views = {}
+        for slot, value in state.items():
+            setattr(self, slot, value)
 
-class ChapterAPI:
-    def __init__(self, **kwargs):
-        self.args = kwargs
+    def prepare(self):
+        super().prepare()
+        self.series_api().prepare()
+        return self
 
     def objectify(self):
         return {
-            "series": self.args["series"],
-            "pages": self.args["pages"],
-            "chapter": self.args["chapter"],
+            slot: getattr(self, slot)
+            for slot in SeriesRecord.__slots__
+            if slot != "_views"
         }
 
+    def _view(self, name, build):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    def series_api(self):
+        return self._view(
+            "series_api",
+            lambda: SeriesAPI(
+                slug=self.slug,
+                title=self.title,
+                description=self.description,
+                author=self.author,
+                artist=self.artist,
+                groups=self.groups,
+                cover=self.cover,
+                chapters=self.chapter_dict,
+            ),
+        )
+
+    def series_page(self):
+        return self._view(
+            "series_page",
+            lambda: SeriesPage(
+                series=self.title,
+                alt_titles=self.alt_titles,
+                alt_titles_str=self.alt_titles_str,
+                slug=self.slug,
+                cover_vol_url=self.cover,
+                metadata=self.metadata,
+                synopsis=self.description,
+                author=self.author,
+                chapter_list=self.chapter_list,
+                original_url=self.original_url,
+            ),
+        )
+
+    def chapter_api(self):
+        if self.pages_list is None:
+            return None
+        return self._view(
+            "chapter_api",
+            lambda: ChapterAPI(
+                pages=self.pages_list, series=self.slug, chapter=self.slug,
+            ),
+        )
+
 
 class ProxyException(Exception):
+    # Whether api_cache may remember the failure for PROXY_NEGATIVE_CACHE_TTL.
+    cacheable = True
+
     def __init__(self, message):
         self.message = message
 
 
+class ProxyBusyException(ProxyException):
+    """The request was shed to protect capacity, by a bulkhead or an open
+    circuit; it says nothing about the upstream data, so it's never cached."""
+
+    cacheable = False
+
+
 class WrappedProxyDict(dict):
     def get(self, key, default=None, exception: str = None):
         _default_res = super().get(key, default)
@@ -1,10 +1,24 @@
+import asyncio
 import base64
+import inspect
+import logging
+import pickle
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from time import time as unix_time
 
 import requests
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
 from django.conf import settings
 from urllib.parse import urlparse
-from .data import ProxyException
+from . import metrics, timing
+from .breaker import CircuitBreaker
+from .bulkhead import Bulkhead
+from .data import ProxyData, ProxyException
+from .local_cache import LocalLRUCache
+from .sessions import get_session
 
 ENCODE_STR_SLASH = "%FF-"
 ENCODE_STR_QUESTION = "%DE-"
@@ -15,11 +29,24 @@ GLOBAL_HEADERS = {
 PROXY = "https://cubari-cors.herokuapp.com/"
 
 REQUEST_TIMEOUT = 8
-SENSOR_TIMEOUT_PREFIX = "timeout_sensor/"
-SENSOR_TIMEOUT_TTL = 10 * 60  # 10 minute timeout on automatic suspension.
-SENSOR_TIMEOUT_MAX_FAILURES = (
-    25  # 25 requests within 5 minutes time out? Drop the proxy.
-)
+API_CACHE_LOCK_PREFIX = "api_cache_lock/"
+API_CACHE_LOCK_TTL = REQUEST_TIMEOUT * 3  # Outlive a slow multi-request rebuild.
+API_CACHE_LOCK_WAIT = 5  # Seconds a follower waits on the leader's rebuild.
+API_CACHE_LOCK_POLL = 0.1
+API_CACHE_STALE_TTL = 30 * 60  # Serve-stale window past the soft TTL.
+API_CACHE_REFRESH_WORKERS = 4
+# Dropped by cache.clear() or clear_local_caches(); every worker's local cache
+# empties itself within LOCAL_CACHE_CHECK seconds of it changing.
+LOCAL_CACHE_GENERATION_KEY = "api_cache_local_generation"
+LOCAL_CACHE_CHECK = 1
+
+logger = logging.getLogger(__name__)
+
+
+def off_loop(f):
+    """Wraps a blocking function, such as one making cache calls, for
+    coroutines to await in a worker thread rather than on the event loop."""
+    return sync_to_async(f, thread_sensitive=False)
 
 
 def naive_encode(url):
@@ -42,33 +69,61 @@ def encode(url: str):
 
 
 def sensored_request_handler(req_handler, original_url):
-    original_hostname = urlparse(original_url).hostname
-    sensor_cache_key = f"{SENSOR_TIMEOUT_PREFIX}{original_hostname}"
+    hostname = urlparse(original_url).hostname
+    with Bulkhead(hostname):
+        breaker = CircuitBreaker(hostname)
+        probe = breaker.before_request()
 
-    if cache.get(sensor_cache_key, 0) > SENSOR_TIMEOUT_MAX_FAILURES:
-        raise ProxyException(
-            f"This proxy has temporarily been disabled due to service degradation. Please try again in {SENSOR_TIMEOUT_TTL / 60} minutes."
-        )
+        started = monotonic()
+        try:
+            resp = req_handler()
+        except requests.exceptions.Timeout:
+            metrics.record_upstream(hostname, started, "timeout")
+            breaker.record_failure(probe)
+            raise ProxyException("Downstream server timed out. Please try again.")
+        except requests.exceptions.ConnectionError:
+            metrics.record_upstream(hostname, started, "connection_error")
+            breaker.record_failure(probe)
+            raise ProxyException("Couldn't connect to the downstream server.")
+        metrics.record_upstream(hostname, started, resp.status_code)
 
-    try:
-        return req_handler()
-    except requests.exceptions.Timeout:
-        # This isn't atomic, but rather a "best-effort" guard on the number of failures
-        cache.set(
-            sensor_cache_key, cache.get(sensor_cache_key, 0) + 1, SENSOR_TIMEOUT_TTL
-        )
-        raise ProxyException("Downstream server timed out. Please try again.")
+    if resp.status_code >= 500:
+        breaker.record_failure(probe)
+    else:
+        breaker.record_success(probe)
+    return resp
 
 
-def get_wrapper(url, *, headers={}, use_proxy=False, secondary=False, **kwargs):
-    base = settings.EXTERNAL_PROXY_URL if not secondary else settings.SECONDARY_PROXY_URL
-    request_url = (
-        f"{base}/v1/cors/{encode(url)}?source=cubari_host"
-        if use_proxy
-        else url
+def pick_encoding(accept_encoding, available):
+    """Picks the best of the available content codings the client accepts."""
+    accepted = {}
+    for coding in accept_encoding.split(","):
+        coding, _, params = coding.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding in available and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
+
+
+def proxied_url(url, *, use_proxy=False, secondary=False):
+    base = (
+        settings.EXTERNAL_PROXY_URL if not secondary else settings.SECONDARY_PROXY_URL
     )
+    return f"{base}/v1/cors/{encode(url)}?source=cubari_host" if use_proxy else url
+
+
+def get_wrapper(url, *, headers={}, use_proxy=False, secondary=False, **kwargs):
+    request_url = proxied_url(url, use_proxy=use_proxy, secondary=secondary)
     return sensored_request_handler(
-        lambda: requests.get(
+        lambda: get_session(request_url).get(
             request_url,
             headers={**GLOBAL_HEADERS, **headers},
             timeout=REQUEST_TIMEOUT,
@@ -79,13 +134,9 @@ def get_wrapper(url, *, headers={}, use_proxy=False, secondary=False, **kwargs):
 
 
 def post_wrapper(url, headers={}, use_proxy=False, **kwargs):
-    request_url = (
-        f"{settings.EXTERNAL_PROXY_URL}/v1/cors/{encode(url)}?source=cubari_host"
-        if use_proxy
-        else url
-    )
+    request_url = proxied_url(url, use_proxy=use_proxy)
     return sensored_request_handler(
-        lambda: requests.post(
+        lambda: get_session(request_url).post(
             request_url,
             headers={**GLOBAL_HEADERS, **headers},
             timeout=REQUEST_TIMEOUT,
@@ -95,20 +146,387 @@ def post_wrapper(url, headers={}, use_proxy=False, **kwargs):
     )
 
 
-def api_cache(*, prefix, time):
+class CachedValue:
+    """Envelope api_cache stores so readers can tell fresh entries from stale ones.
+
+    The memcached expiry is the hard TTL; fresh_until marks the soft TTL after
+    which the value is still served, but a refresh is kicked off. size is the
+    pickled size of data, measured once when it's stored, which is what the
+    local cache budgets by.
+    """
+
+    __slots__ = ("data", "fresh_until", "size")
+
+    def __init__(self, data, fresh_until, size=0):
+        self.data = data
+        self.fresh_until = fresh_until
+        self.size = size
+
+    def is_fresh(self):
+        return unix_time() < self.fresh_until
+
+
+class CachedFailure:
+    """Negative api_cache entry for an upstream that failed or had nothing.
+
+    Replaying it raises the original ProxyException message, or returns None
+    if the handler itself came back empty.
+    """
+
+    __slots__ = ("message",)
+
+    def __init__(self, message=None):
+        self.message = message
+
+    def replay(self):
+        if self.message is not None:
+            raise ProxyException(self.message)
+        return None
+
+
+local_cache = LocalLRUCache(
+    max_entries=settings.PROXY_LOCAL_CACHE["MAX_ENTRIES"],
+    max_bytes=settings.PROXY_LOCAL_CACHE["MAX_BYTES"],
+    ttl=settings.PROXY_LOCAL_CACHE["TTL"],
+)
+
+_next_generation_check = 0
+
+
+def _check_local_generation():
+    """Empties the local cache if the shared generation stamp has changed
+    since it was filled. Looked up at most every LOCAL_CACHE_CHECK seconds."""
+    global _next_generation_check
+    now = monotonic()
+    if now < _next_generation_check:
+        return
+    _next_generation_check = now + LOCAL_CACHE_CHECK
+    generation = cache.get(LOCAL_CACHE_GENERATION_KEY)
+    if generation is None:
+        cache.add(LOCAL_CACHE_GENERATION_KEY, secrets.token_hex(8), None)
+        generation = cache.get(LOCAL_CACHE_GENERATION_KEY)
+    local_cache.validate(generation)
+
+
+def clear_local_caches():
+    """Makes every worker drop its local api_cache entries."""
+    global _next_generation_check
+    cache.delete(LOCAL_CACHE_GENERATION_KEY)
+    _next_generation_check = 0
+
+
+_refresh_executor = ThreadPoolExecutor(
+    max_workers=API_CACHE_REFRESH_WORKERS, thread_name_prefix="api_cache_refresh"
+)
+_refresh_tasks = set()
+
+
+def _release_lock(lock_key, token):
+    # Only drop the lease if it is still ours; an expired lease may already
+    # have been picked up by another worker.
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+class _CachedHandler:
+    def __init__(self, f, *, prefix, time, stale, negative, coalesce):
+        self.f = f
+        self.prefix = prefix
+        self.time = time
+        self.stale = API_CACHE_STALE_TTL if stale is None else stale
+        self.negative = negative
+        self.coalesce = coalesce
+
+    def __call__(self, source, meta_id):
+        cache_key = f"{self.prefix}_{meta_id}"
+        entry = self.lookup(cache_key)
+        if isinstance(entry, CachedFailure):
+            self.count("failure")
+            return entry.replay()
+        if not isinstance(entry, CachedValue):
+            self.count("miss")
+            if self.coalesce:
+                return self.coalesced_fetch(source, meta_id, cache_key)
+            return self.fetch(source, meta_id, cache_key)
+        if entry.is_fresh():
+            self.count("hit")
+            return entry.data
+        self.count("stale")
+        if settings.PROXY_CACHE_BACKGROUND_REFRESH:
+            self.refresh_in_background(source, meta_id, cache_key)
+            return entry.data
+        return self.fetch(source, meta_id, cache_key, fallback=entry)
+
+    async def acall(self, source, meta_id):
+        """Coroutine counterpart of __call__ for async handlers. The cache is
+        only ever touched from worker threads, off the event loop."""
+        cache_key = f"{self.prefix}_{meta_id}"
+        entry = await off_loop(self.lookup)(cache_key)
+        if isinstance(entry, CachedFailure):
+            self.count("failure")
+            return entry.replay()
+        if not isinstance(entry, CachedValue):
+            self.count("miss")
+            if self.coalesce:
+                return await self.async_coalesced_fetch(source, meta_id, cache_key)
+            return await self.async_fetch(source, meta_id, cache_key)
+        if entry.is_fresh():
+            self.count("hit")
+            return entry.data
+        self.count("stale")
+        if settings.PROXY_CACHE_BACKGROUND_REFRESH:
+            await self.async_refresh_in_background(source, meta_id, cache_key)
+            return entry.data
+        return await self.async_fetch(source, meta_id, cache_key, fallback=entry)
+
+    def count(self, result):
+        metrics.inc("cubari_api_cache_total", prefix=self.prefix, result=result)
+
+    def rebuild(self, source, meta_id):
+        with metrics.handler_span(source.get_reader_prefix(), self.prefix):
+            return self.f(source, meta_id)
+
+    async def async_rebuild(self, source, meta_id):
+        with metrics.handler_span(source.get_reader_prefix(), self.prefix):
+            return await self.f(source, meta_id)
+
+    def lookup(self, cache_key):
+        with timing.phase("cache"):
+            return self._lookup(cache_key)
+
+    def _lookup(self, cache_key):
+        _check_local_generation()
+        entry = local_cache.get(cache_key)
+        if entry is not None:
+            return entry
+        entry = cache.get(cache_key)
+        if isinstance(entry, CachedValue) and entry.is_fresh():
+            local_cache.set(
+                cache_key,
+                entry,
+                entry.fresh_until - unix_time(),
+                size=getattr(entry, "size", 0),
+            )
+        return entry
+
+    def store(self, cache_key, data):
+        if isinstance(data, ProxyData):
+            data.prepare()
+        entry = CachedValue(
+            data,
+            unix_time() + self.time,
+            len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)),
+        )
+        cache.set(cache_key, entry, self.time + self.stale)
+        local_cache.set(cache_key, entry, self.time, size=entry.size)
+
+    def store_failure(self, cache_key, message=None):
+        negative = (
+            settings.PROXY_NEGATIVE_CACHE_TTL
+            if self.negative is None
+            else self.negative
+        )
+        if negative:
+            cache.set(cache_key, CachedFailure(message), negative)
+
+    def settle(self, cache_key, data, fallback):
+        """Stores a fresh result, or falls back to the stale value if it's empty."""
+        if not data:
+            if fallback is None:
+                self.store_failure(cache_key)
+                return None
+            return fallback.data
+        self.store(cache_key, data)
+        return data
+
+    def settle_error(self, cache_key, e, fallback):
+        """Serves the stale value for a failed rebuild, or re-raises."""
+        if fallback is None:
+            if isinstance(e, ProxyException) and e.cacheable:
+                self.store_failure(cache_key, e.message)
+            raise e
+        logger.warning(f"Serving stale {cache_key} after refresh failed: {e}")
+        return fallback.data
+
+    def fetch(self, source, meta_id, cache_key, fallback=None):
+        """Rebuild the entry, serving the stale value if the upstream fails."""
+        try:
+            data = self.rebuild(source, meta_id)
+        except Exception as e:
+            return self.settle_error(cache_key, e, fallback)
+        return self.settle(cache_key, data, fallback)
+
+    async def async_fetch(self, source, meta_id, cache_key, fallback=None):
+        try:
+            data = await self.async_rebuild(source, meta_id)
+        except Exception as e:
+            return await off_loop(self.settle_error)(cache_key, e, fallback)
+        return await off_loop(self.settle)(cache_key, data, fallback)
+
+    def warm(self, source, meta_id, within):
+        """Rebuilds the entry unless it stays fresh for another `within`
+        seconds, or someone else is already rebuilding it. Returns whether it
+        was rebuilt; upstream errors are raised to the caller."""
+        cache_key = f"{self.prefix}_{meta_id}"
+        entry = cache.get(cache_key)
+        if isinstance(entry, CachedValue) and entry.fresh_until - unix_time() > within:
+            return False
+        lock_key = f"{API_CACHE_LOCK_PREFIX}{cache_key}"
+        token = secrets.token_hex(8)
+        if not cache.add(lock_key, token, API_CACHE_LOCK_TTL):
+            return False
+        try:
+            data = self.rebuild(source, meta_id)
+            if data:
+                self.store(cache_key, data)
+        finally:
+            _release_lock(lock_key, token)
+        return True
+
+    def peek(self, source, meta_id):
+        """The cached value, fresh or stale, or None; never fetches it."""
+        entry = self._lookup(f"{self.prefix}_{meta_id}")
+        return entry.data if isinstance(entry, CachedValue) else None
+
+    def poll(self, cache_key):
+        """Returns (done, result) for a follower waiting on another rebuild."""
+        entry = cache.get(cache_key)
+        if isinstance(entry, CachedValue):
+            return True, entry.data
+        if isinstance(entry, CachedFailure):
+            return True, entry.replay()
+        return False, None
+
+    def coalesced_fetch(self, source, meta_id, cache_key):
+        """Single-flight wrapper around an api_cache miss.
+
+        The first caller to win the memcached lease rebuilds the entry; everyone
+        else polls the cache until it's filled, or until the lease is released
+        and they can take it over themselves. Since cache.add is atomic on
+        memcached, this holds across gunicorn workers and not just threads.
+        """
+        lock_key = f"{API_CACHE_LOCK_PREFIX}{cache_key}"
+        token = secrets.token_hex(8)
+        deadline = monotonic() + API_CACHE_LOCK_WAIT
+        while True:
+            if cache.add(lock_key, token, API_CACHE_LOCK_TTL):
+                try:
+                    # A leader may have filled the entry and let go of the
+                    # lease since our lookup missed.
+                    done, data = self.poll(cache_key)
+                    if done:
+                        return data
+                    return self.fetch(source, meta_id, cache_key)
+                finally:
+                    _release_lock(lock_key, token)
+            if monotonic() >= deadline:
+                break
+            sleep(API_CACHE_LOCK_POLL)
+            done, data = self.poll(cache_key)
+            if done:
+                return data
+
+        # The leader is taking longer than we're willing to wait, so fall back
+        # to fetching it ourselves rather than failing the request.
+        return self.fetch(source, meta_id, cache_key)
+
+    async def async_coalesced_fetch(self, source, meta_id, cache_key):
+        lock_key = f"{API_CACHE_LOCK_PREFIX}{cache_key}"
+        token = secrets.token_hex(8)
+        deadline = monotonic() + API_CACHE_LOCK_WAIT
+        poll = off_loop(self.poll)
+        while True:
+            if await off_loop(cache.add)(lock_key, token, API_CACHE_LOCK_TTL):
+                try:
+                    done, data = await poll(cache_key)
+                    if done:
+                        return data
+                    return await self.async_fetch(source, meta_id, cache_key)
+                finally:
+                    await off_loop(_release_lock)(lock_key, token)
+            if monotonic() >= deadline:
+                break
+            await asyncio.sleep(API_CACHE_LOCK_POLL)
+            done, data = await poll(cache_key)
+            if done:
+                return data
+
+        return await self.async_fetch(source, meta_id, cache_key)
+
+    def refresh_in_background(self, source, meta_id, cache_key):
+        lock_key = f"{API_CACHE_LOCK_PREFIX}{cache_key}"
+        token = secrets.token_hex(8)
+        # Someone else already holds the lease, so a refresh is in flight.
+        if not cache.add(lock_key, token, API_CACHE_LOCK_TTL):
+            return
+
+        def refresh():
+            try:
+                data = self.rebuild(source, meta_id)
+                if data:
+                    self.store(cache_key, data)
+            except Exception as e:
+                logger.warning(f"Background refresh of {cache_key} failed: {e}")
+            finally:
+                _release_lock(lock_key, token)
+
+        _refresh_executor.submit(refresh)
+
+    async def async_refresh_in_background(self, source, meta_id, cache_key):
+        lock_key = f"{API_CACHE_LOCK_PREFIX}{cache_key}"
+        token = secrets.token_hex(8)
+        if not await off_loop(cache.add)(lock_key, token, API_CACHE_LOCK_TTL):
+            return
+
+        async def refresh():
+            try:
+                data = await self.async_rebuild(source, meta_id)
+                if data:
+                    await off_loop(self.store)(cache_key, data)
+            except Exception as e:
+                logger.warning(f"Background refresh of {cache_key} failed: {e}")
+            finally:
+                await off_loop(_release_lock)(lock_key, token)
+
+        # The event loop only keeps weak references to its tasks.
+        task = asyncio.ensure_future(refresh())
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+
+
+def api_cache(*, prefix, time, stale=None, negative=None, coalesce=True):
+    """Caches a source handler's result under {prefix}_{meta_id}.
+
+    Entries are fresh for `time` seconds, then served stale for up to `stale`
+    more seconds while they're refreshed, or while the upstream is failing.
+    Empty results and ProxyExceptions are remembered for `negative` seconds
+    (settings.PROXY_NEGATIVE_CACHE_TTL by default, 0 to disable).
+    Coroutine handlers get a coroutine wrapper sharing the same cache entries,
+    so a sync and an async handler with the same prefix are interchangeable.
+    """
+
     def wrapper(f):
+        handler = _CachedHandler(
+            f,
+            prefix=prefix,
+            time=time,
+            stale=stale,
+            negative=negative,
+            coalesce=coalesce,
+        )
+
+        if inspect.iscoroutinefunction(f):
+
+            async def async_inner(self, meta_id):
+                return await handler.acall(self, meta_id)
+
+            return async_inner
+
         def inner(self, meta_id):
-            data = cache.get(f"{prefix}_{meta_id}")
-            if not data:
-                data = f(self, meta_id)
-                if not data:
-                    return None
-                else:
-                    cache.set(f"{prefix}_{meta_id}", data, time)
-                    return data
-            else:
-                return data
+            return handler(self, meta_id)
 
+        inner.warm = handler.warm
+        inner.peek = handler.peek
         return inner
 
     return wrapper
@@ -0,0 +1,320 @@
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import monotonic, sleep
+
+from django.core.cache import cache
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "metrics/"
+METRICS_REGISTRY_KEY = f"{METRICS_PREFIX}registry"
+METRICS_FLUSH_INTERVAL = 5
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    "cubari_upstream_request_seconds": (
+        "histogram",
+        "Latency of upstream requests made by proxy sources.",
+    ),
+    "cubari_upstream_requests_total": (
+        "counter",
+        "Upstream requests by outcome: the status code, or why no response came back.",
+    ),
+    "cubari_api_cache_total": (
+        "counter",
+        "api_cache lookups by result.",
+    ),
+    "cubari_source_handler_seconds": (
+        "histogram",
+        "Time spent rebuilding an api_cache entry.",
+    ),
+    "cubari_source_phase_seconds_total": (
+        "counter",
+        "Rebuild time split into waiting on upstreams (fetch) and everything else (parse).",
+    ),
+    "cubari_breaker_state": (
+        "gauge",
+        "Circuit breaker state per upstream host: 0 closed, 1 half-open, 2 open.",
+    ),
+    "cubari_breaker_failures": (
+        "gauge",
+        "Upstream failures counted in the circuit breaker's current window.",
+    ),
+    "cubari_local_cache_entries": (
+        "gauge",
+        "Entries held in the worker's in-process api_cache layer.",
+    ),
+    "cubari_local_cache_bytes": (
+        "gauge",
+        "Approximate size of the entries held in the in-process layer.",
+    ),
+    "cubari_local_cache_hits_total": (
+        "counter",
+        "In-process api_cache lookups answered without going to the shared cache.",
+    ),
+    "cubari_local_cache_misses_total": (
+        "counter",
+        "In-process api_cache lookups that fell through to the shared cache.",
+    ),
+    "cubari_local_cache_evictions_total": (
+        "counter",
+        "Entries dropped from the in-process layer to stay within its limits.",
+    ),
+    "cubari_upstream_pool_max_size": (
+        "gauge",
+        "Keep-alive connections the worker's pool for an upstream host may hold.",
+    ),
+    "cubari_upstream_pool_connections_opened_total": (
+        "counter",
+        "New connections opened by the worker's pool for an upstream host.",
+    ),
+    "cubari_upstream_pool_requests_total": (
+        "counter",
+        "Requests sent through the worker's pool for an upstream host.",
+    ),
+}
+
+# Counters are buffered per process and added to the shared cache every few
+# seconds, so a request costs a dict update instead of cache round trips.
+# The flush runs on its own thread, so those round trips never hold up a
+# request thread or an event loop either. Memcached can't list keys, so every
+# series ever written is also kept in a registry that the endpoint reads back.
+_pending = {}
+_series = set()
+_lock = threading.Lock()
+_flusher = None
+
+
+def reset_metrics():
+    global _lock, _flusher
+    _pending.clear()
+    _series.clear()
+    _lock = threading.Lock()
+    # Threads don't survive a fork, so the child starts its own flusher.
+    _flusher = None
+
+
+os.register_at_fork(after_in_child=reset_metrics)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _key(name, labels):
+    label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{METRICS_PREFIX}{name}{{{label_str}}}"
+
+
+def inc(name, amount=1, **labels):
+    global _flusher
+    series = (name, _labels(labels))
+    with _lock:
+        _pending[series] = _pending.get(series, 0) + amount
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_forever, name="metrics-flush", daemon=True
+            )
+            _flusher.start()
+
+
+def observe(name, seconds, **labels):
+    """Histograms are stored as per-bucket counts (made cumulative when
+    rendered) and a sum in milliseconds, since the cache only adds integers.
+    Any other series whose name ends in _ms is rendered in seconds."""
+    le = next((bound for bound in LATENCY_BUCKETS if seconds <= bound), "+Inf")
+    inc(f"{name}_bucket", le=le, **labels)
+    inc(f"{name}_sum_ms", int(seconds * 1000), **labels)
+
+
+def _add(key, amount):
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def _flush_forever():
+    while True:
+        sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Couldn't flush metrics")
+
+
+def flush():
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _series.update(pending)
+        series = set(_series)
+    for (name, labels), amount in pending.items():
+        if amount:
+            _add(_key(name, labels), amount)
+    # Re-checked on every flush, so a registration lost to a concurrent
+    # writer is put back the next time around.
+    registry = cache.get(METRICS_REGISTRY_KEY) or set()
+    if not series <= registry:
+        cache.set(METRICS_REGISTRY_KEY, registry | series, None)
+
+
+class _Span:
+    __slots__ = ("parent", "source", "intervals")
+
+    def __init__(self, parent, source):
+        self.parent = parent
+        self.source = source
+        self.intervals = []
+
+
+_current_span = contextvars.ContextVar("proxy_metrics_span", default=None)
+
+
+def current_source():
+    span = _current_span.get()
+    return span.source if span else "none"
+
+
+@contextmanager
+def handler_span(source, prefix):
+    """Times an api_cache rebuild, splitting it into the wall time spent on
+    upstream requests and the rest. Thread pools don't inherit the context,
+    so hand them work through in_context() to keep the attribution."""
+    span = _Span(_current_span.get(), source)
+    token = _current_span.set(span)
+    started = monotonic()
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+        elapsed = monotonic() - started
+        fetch = min(_covered(span.intervals), elapsed)
+        if span.parent is None:
+            timing.record("fetch", fetch)
+            timing.record("parse", elapsed - fetch)
+        observe("cubari_source_handler_seconds", elapsed, source=source, prefix=prefix)
+        inc(
+            "cubari_source_phase_seconds_total_ms",
+            int(fetch * 1000),
+            source=source,
+            prefix=prefix,
+            phase="fetch",
+        )
+        inc(
+            "cubari_source_phase_seconds_total_ms",
+            int((elapsed - fetch) * 1000),
+            source=source,
+            prefix=prefix,
+            phase="parse",
+        )
+
+
+def _covered(intervals):
+    """Total time covered by possibly overlapping (start, end) intervals."""
+    total = 0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is None or start > covered_until:
+            total += end - start
+            covered_until = end
+        elif end > covered_until:
+            total += end - covered_until
+            covered_until = end
+    return total
+
+
+def in_context(f):
+    """Wraps f to run in a copy of the caller's context, for thread pools."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(f, *args, **kwargs)
+
+
+def record_upstream(hostname, started, outcome):
+    ended = monotonic()
+    span = _current_span.get()
+    source = span.source if span else "none"
+    if span is None:
+        timing.record("fetch", ended - started)
+    while span:
+        span.intervals.append((started, ended))
+        span = span.parent
+    observe(
+        "cubari_upstream_request_seconds", ended - started, source=source, host=hostname
+    )
+    inc("cubari_upstream_requests_total", source=source, host=hostname, outcome=outcome)
+
+
+def record_rejected(hostname, outcome):
+    inc(
+        "cubari_upstream_requests_total",
+        source=current_source(),
+        host=hostname,
+        outcome=outcome,
+    )
+
+
+def render(extra=()):
+    """Prometheus text exposition of everything in the registry, plus any
+    (name, labels, value) gauges passed in."""
+    flush()
+    series = sorted(cache.get(METRICS_REGISTRY_KEY) or ())
+    values = cache.get_many([_key(name, labels) for name, labels in series])
+
+    families = {}
+    for name, labels in series:
+        value = values.get(_key(name, labels))
+        if value is None:
+            continue
+        if name.endswith("_bucket"):
+            family = name[: -len("_bucket")]
+            le = dict(labels)["le"]
+            group = tuple(label for label in labels if label[0] != "le")
+            families.setdefault(family, {}).setdefault(group, {})[le] = value
+        elif name.endswith("_sum_ms"):
+            family = name[: -len("_sum_ms")]
+            families.setdefault(family, {}).setdefault(labels, {})["sum"] = value
+        elif name.endswith("_ms"):
+            families.setdefault(name[: -len("_ms")], {})[labels] = value / 1000
+        else:
+            families.setdefault(name, {})[labels] = value
+
+    lines = []
+    for family, samples in sorted(families.items()):
+        kind, description = HELP.get(family, ("untyped", family))
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for labels, value in sorted(samples.items()):
+            if kind != "histogram":
+                lines.append(f"{_key(family, labels)[len(METRICS_PREFIX):]} {value}")
+                continue
+            cumulative = 0
+            for bound in (*LATENCY_BUCKETS, "+Inf"):
+                cumulative += value.get(str(bound), 0)
+                bucket_labels = tuple(sorted((*labels, ("le", str(bound)))))
+                lines.append(
+                    f"{_key(family + '_bucket', bucket_labels)[len(METRICS_PREFIX):]} {cumulative}"
+                )
+            lines.append(
+                f"{_key(family + '_sum', labels)[len(METRICS_PREFIX):]} {value.get('sum', 0) / 1000}"
+            )
+            lines.append(
+                f"{_key(family + '_count', labels)[len(METRICS_PREFIX):]} {cumulative}"
+            )
+
+    described = set()
+    for name, labels, value in extra:
+        if name not in described:
+            described.add(name)
+            kind, description = HELP.get(name, ("gauge", name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{_key(name, _labels(labels))[len(METRICS_PREFIX):]} {value}")
+    return "\n".join(lines) + "\n"
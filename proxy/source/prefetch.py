@@ -0,0 +1,68 @@
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Per-process queue of warm-up jobs, started on first use. Jobs are keyed so
+# the same one is never queued twice, and dropped when the queue is full:
+# a prefetch that doesn't happen only costs the reader one cache miss.
+_queue = None
+_queued = set()
+_lock = threading.Lock()
+
+
+def reset_prefetch():
+    """Forked children don't inherit the worker threads, so start over."""
+    global _queue, _lock
+    _queue = None
+    _queued.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_prefetch)
+
+
+def _work(jobs):
+    while True:
+        key, job = jobs.get()
+        try:
+            job()
+        except Exception as e:
+            logger.warning(f"Prefetch {key} failed: {e}")
+        finally:
+            with _lock:
+                _queued.discard(key)
+
+
+def _jobs():
+    global _queue
+    if _queue is None:
+        _queue = queue.Queue(maxsize=settings.PROXY_PREFETCH["QUEUE_SIZE"])
+        for index in range(settings.PROXY_PREFETCH["WORKERS"]):
+            threading.Thread(
+                target=_work,
+                args=(_queue,),
+                name=f"prefetch_{index}",
+                daemon=True,
+            ).start()
+    return _queue
+
+
+def prefetch(key, job):
+    """Runs job() on a background thread, unless one with the same key is
+    already waiting or the queue is full. Returns whether it was queued."""
+    if not settings.PROXY_PREFETCH["WORKERS"]:
+        return False
+    with _lock:
+        if key in _queued:
+            return False
+        try:
+            _jobs().put_nowait((key, job))
+        except queue.Full:
+            return False
+        _queued.add(key)
+    return True
@@ -0,0 +1,68 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _pool_size(hostname):
+    pool_sizes = settings.PROXY_CONNECTION_POOLS
+    return pool_sizes.get(hostname, pool_sizes["default"])
+
+
+def _new_session(hostname):
+    session = requests.Session()
+    # The session is shared by every request in the process, so upstream
+    # cookies must never stick around and leak between our own users.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # Only one host is ever requested through this session, but the pool
+    # can grow to the per-host size; overflow connections are just dropped.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size(hostname))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url):
+    """Returns the process-wide keep-alive session for the URL's hostname."""
+    hostname = urlparse(url).hostname
+    session = _sessions.get(hostname)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(hostname)
+            if session is None:
+                session = _sessions[hostname] = _new_session(hostname)
+    return session
+
+
+def reset_sessions():
+    """Drops every pooled connection. Sockets can't be shared with a forked
+    child, so gunicorn workers start from an empty set of pools."""
+    global _sessions_lock
+    _sessions.clear()
+    _sessions_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_sessions)
+
+
+def pool_stats():
+    stats = {}
+    for hostname, session in list(_sessions.items()):
+        pools = session.get_adapter("https://").poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            stats[f"{pool_key.key_scheme}://{hostname}"] = {
+                "max_size": pool.pool.maxsize if pool.pool else 0,
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+    return stats
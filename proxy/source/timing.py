@@ -0,0 +1,58 @@
+import contextvars
+from contextlib import contextmanager
+from time import monotonic
+
+_current_timings = contextvars.ContextVar("proxy_request_timings", default=None)
+
+
+class RequestTimings:
+    """Wall time per phase of one request, in the order phases first ran."""
+
+    __slots__ = ("phases", "started")
+
+    def __init__(self):
+        self.phases = {}
+        self.started = monotonic()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def total(self):
+        return monotonic() - self.started
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds."""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}"
+            for name, seconds in (*self.phases.items(), ("total", self.total()))
+        )
+
+
+def start_timings():
+    """Starts collecting phases for the current request. Returns the reset
+    token for stop_timings along with the collector."""
+    timings = RequestTimings()
+    return _current_timings.set(timings), timings
+
+
+def stop_timings(token):
+    _current_timings.reset(token)
+
+
+def record(name, seconds):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = monotonic()
+    try:
+        yield
+    finally:
+        timings.add(name, monotonic() - started)
@@ -4,7 +4,7 @@ from typing import List, Optional, Dict
 from django.shortcuts import redirect
 from django.urls import re_path
 
-from proxy.source import ProxySource, SeriesPage, ChapterAPI, SeriesAPI, api_cache, post_wrapper
+from proxy.source import ProxySource, SeriesRecord, api_cache, post_wrapper
 
 
 class Catbox(ProxySource):
@@ -18,7 +18,6 @@ class Catbox(ProxySource):
 
         return [re_path(r"^c/(?P<album_hash>\w+)/$", handler)]
 
-    @api_cache(prefix="catbox_api_dt", time=300)
     def catbox_common(self, meta_id: str) -> Optional[Dict]:
         resp = post_wrapper(f"https://catbox.moe/user/api.php", data={"reqtype": "getalbum", "short": meta_id})
 
@@ -76,41 +75,7 @@ class Catbox(ProxySource):
             "original_url": "https://catbox.moe/c/" + meta_id,
         }
 
-    @api_cache(prefix="catbox_series_dt", time=300)
-    def series_api_handler(self, meta_id: str) -> SeriesAPI:
+    @api_cache(prefix="catbox_record_dt", time=300)
+    def series_record(self, meta_id: str) -> Optional[SeriesRecord]:
         data = self.catbox_common(meta_id)
-        return data and SeriesAPI(
-            slug=data["slug"],
-            title=data["title"],
-            description=data["description"],
-            author=data["author"],
-            artist=data["artist"],
-            groups=data["groups"],
-            cover=data["cover"],
-            chapters=data["chapter_dict"]
-        )
-
-    @api_cache(prefix="catbox_pages_dt", time=300)
-    def chapter_api_handler(self, meta_id: str) -> ChapterAPI:
-        data = self.catbox_common(meta_id)
-        return data and ChapterAPI(
-            pages=data["pages_list"],
-            series=data["slug"],
-            chapter=data["slug"]
-        )
-
-    @api_cache(prefix="catbox_series_page_dt", time=300)
-    def series_page_handler(self, meta_id: str) -> SeriesPage:
-        data = self.catbox_common(meta_id)
-        return data and SeriesPage(
-            series=data["title"],
-            alt_titles=[],
-            alt_titles_str=None,
-            slug=data["slug"],
-            cover_vol_url=data["cover"],
-            metadata=[],
-            synopsis=data["description"],
-            author=data["author"],
-            chapter_list=data["chapter_list"],
-            original_url=data["original_url"]
-        )
+        return data and SeriesRecord(**data)
@@ -9,7 +9,7 @@ from django.shortcuts import redirect
 from django.urls import re_path
 
 from ..source import ProxySource
-from ..source.data import ChapterAPI, SeriesAPI, SeriesPage
+from ..source.data import ChapterAPI, SeriesRecord
 from ..source.helpers import api_cache, get_wrapper
 
 
@@ -124,41 +124,25 @@ class Dynasty(ProxySource):
                     }
                 except:
                     pass
-            return {
-                "slug": meta_id,
-                "title": title,
-                "description": description,
-                "series": title,
-                "alt_titles_str": None,
-                "cover_vol_url": cover,
-                "metadata": [],
-                "author": author,
-                "artist": author,
-                "groups": groups_dict,
-                "cover": cover,
-                "chapter_dict": chapter_dict,
-                "chapter_list": chapter_list,
-            }
-        else:
-            return None
-
-    @api_cache(prefix="ds_series_dt", time=600)
-    def series_api_handler(self, meta_id):
-        data = self.ds_scrape_common(meta_id)
-        if data:
-            return SeriesAPI(
-                slug=data["slug"],
-                title=data["title"],
-                description=data["description"],
-                author=data["author"],
-                artist=data["artist"],
-                groups=data["groups"],
-                cover=data["cover"],
-                chapters=data["chapter_dict"],
+            return SeriesRecord(
+                slug=meta_id,
+                title=title,
+                description=description,
+                author=author,
+                artist=author,
+                groups=groups_dict,
+                cover=cover,
+                chapter_dict=chapter_dict,
+                chapter_list=chapter_list,
+                original_url=series_url,
             )
         else:
             return None
 
+    @api_cache(prefix="ds_record_dt", time=600)
+    def series_record(self, meta_id):
+        return self.ds_scrape_common(meta_id)
+
     @api_cache(prefix="ds_chapter_dt", time=3600)
     def chapter_api_handler(self, meta_id):
         base_url = "https://dynasty-scans.com"
@@ -174,24 +158,3 @@ class Dynasty(ProxySource):
                 return ChapterAPI(pages=pages, series=meta_id, chapter="")
             except:
                 return None
-
-    @api_cache(prefix="ds_series_page_dt", time=600)
-    def series_page_handler(self, meta_id):
-        data = self.ds_scrape_common(meta_id)
-        original_url = "https://dynasty-scans.com/series/" + meta_id
-
-        if data:
-            return SeriesPage(
-                series=data["title"],
-                alt_titles=[],
-                alt_titles_str=None,
-                slug=data["slug"],
-                cover_vol_url=data["cover"],
-                metadata=[],
-                synopsis=data["description"],
-                author=data["artist"],
-                chapter_list=data["chapter_list"],
-                original_url=original_url,
-            )
-        else:
-            return None
@@ -54,6 +54,8 @@ DOMAIN_MAPPING: Dict[str, str] = {
 
 
 class Gist(ProxySource):
+    warm_handlers = ("gist_common", "series_api_handler", "series_page_handler")
+
     def get_reader_prefix(self):
         return "gist"
 
@@ -4,7 +4,7 @@ from django.shortcuts import redirect
 from django.urls import re_path
 
 from ..source import ProxySource
-from ..source.data import ChapterAPI, ProxyException, SeriesAPI, SeriesPage
+from ..source.data import ProxyException, SeriesRecord
 from ..source.helpers import api_cache, post_wrapper
 
 
@@ -76,55 +76,7 @@ class Imgbb(ProxySource):
         else:
             raise ProxyException("Imgbb failed to load.")
 
-    @api_cache(prefix="imgbb_api_dt", time=300)
-    def imgbb_common(self, meta_id):
-        return self.imgbb_api(meta_id)
-
-    @api_cache(prefix="imgbb_series_dt", time=300)
-    def series_api_handler(self, meta_id):
-        data = self.imgbb_api(meta_id)
-        return (
-            SeriesAPI(
-                slug=data["slug"],
-                title=data["title"],
-                description=data["description"],
-                author=data["author"],
-                artist=data["artist"],
-                groups=data["groups"],
-                cover=data["cover"],
-                chapters=data["chapter_dict"],
-            )
-            if data
-            else None
-        )
-
-    @api_cache(prefix="imgbb_pages_dt", time=300)
-    def chapter_api_handler(self, meta_id):
+    @api_cache(prefix="imgbb_record_dt", time=300)
+    def series_record(self, meta_id):
         data = self.imgbb_api(meta_id)
-        return (
-            ChapterAPI(
-                pages=data["pages_list"], series=data["slug"], chapter=data["slug"]
-            )
-            if data
-            else None
-        )
-
-    @api_cache(prefix="imgbb_series_page_dt", time=300)
-    def series_page_handler(self, meta_id):
-        data = self.imgbb_api(meta_id)
-        return (
-            SeriesPage(
-                series=data["title"],
-                alt_titles=[],
-                alt_titles_str=None,
-                slug=data["slug"],
-                cover_vol_url=data["cover"],
-                metadata=[],
-                synopsis=data["description"],
-                author=data["author"],
-                chapter_list=data["chapter_list"],
-                original_url=data["original_url"],
-            )
-            if data
-            else None
-        )
+        return data and SeriesRecord(**data)
@@ -5,7 +5,7 @@ from django.shortcuts import redirect
 from django.urls import re_path
 
 from ..source import ProxySource
-from ..source.data import ChapterAPI, SeriesAPI, SeriesPage
+from ..source.data import SeriesRecord
 from ..source.helpers import api_cache, get_wrapper
 
 
@@ -33,7 +33,6 @@ class Imgbox(ProxySource):
         # if all thumbnail -> original URLs map cleanly like so
         return re.sub(r"_\w.", "_o.", url.replace("thumbs2", "images2"))
 
-    @api_cache(prefix="imgbox_api_dt", time=300)
     def imgbox_common(self, meta_id):
         resp = get_wrapper(f"https://imgbox.com/g/{meta_id}")
         if resp.status_code == 200:
@@ -77,51 +76,7 @@ class Imgbox(ProxySource):
         else:
             return None
 
-    @api_cache(prefix="imgbox_series_dt", time=300)
-    def series_api_handler(self, meta_id):
+    @api_cache(prefix="imgbox_record_dt", time=300)
+    def series_record(self, meta_id):
         data = self.imgbox_common(meta_id)
-        return (
-            SeriesAPI(
-                slug=data["slug"],
-                title=data["title"],
-                description=data["description"],
-                author=data["author"],
-                artist=data["artist"],
-                groups=data["groups"],
-                cover=data["cover"],
-                chapters=data["chapter_dict"],
-            )
-            if data
-            else None
-        )
-
-    @api_cache(prefix="imgbox_pages_dt", time=300)
-    def chapter_api_handler(self, meta_id):
-        data = self.imgbox_common(meta_id)
-        return (
-            ChapterAPI(
-                pages=data["pages_list"], series=data["slug"], chapter=data["slug"]
-            )
-            if data
-            else None
-        )
-
-    @api_cache(prefix="imgbox_series_page_dt", time=300)
-    def series_page_handler(self, meta_id):
-        data = self.imgbox_common(meta_id)
-        return (
-            SeriesPage(
-                series=data["title"],
-                alt_titles=[],
-                alt_titles_str=None,
-                slug=data["slug"],
-                cover_vol_url=data["cover"],
-                metadata=[],
-                synopsis=data["description"],
-                author=data["author"],
-                chapter_list=data["chapter_list"],
-                original_url=data["original_url"],
-            )
-            if data
-            else None
-        )
+        return data and SeriesRecord(**data)
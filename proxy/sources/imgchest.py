@@ -6,7 +6,7 @@ from bs4 import BeautifulSoup
 from django.shortcuts import redirect
 from django.urls import re_path
 
-from proxy.source import ProxySource, SeriesPage, ChapterAPI, SeriesAPI, api_cache, get_wrapper
+from proxy.source import ProxySource, SeriesRecord, api_cache, get_wrapper
 
 
 class ImageChest(ProxySource):
@@ -20,7 +20,6 @@ class ImageChest(ProxySource):
 
         return [re_path(r"^p/(?P<album_hash>\w+)/$", handler)]
 
-    @api_cache(prefix="imgchest_api_dt", time=300)
     def imgchest_common(self, meta_id: str) -> Optional[Dict]:
         url = f"https://imgchest.com/p/{meta_id}"
 
@@ -68,41 +67,7 @@ class ImageChest(ProxySource):
             "original_url": url,
         }
 
-    @api_cache(prefix="imgchest_series_dt", time=300)
-    def series_api_handler(self, meta_id: str) -> SeriesAPI:
+    @api_cache(prefix="imgchest_record_dt", time=300)
+    def series_record(self, meta_id: str) -> Optional[SeriesRecord]:
         data = self.imgchest_common(meta_id)
-        return data and SeriesAPI(
-            slug=data["slug"],
-            title=data["title"],
-            description=data["description"],
-            author=data["author"],
-            artist=data["artist"],
-            groups=data["groups"],
-            cover=data["cover"],
-            chapters=data["chapter_dict"]
-        )
-
-    @api_cache(prefix="imgchest_pages_dt", time=300)
-    def chapter_api_handler(self, meta_id: str) -> ChapterAPI:
-        data = self.imgchest_common(meta_id)
-        return data and ChapterAPI(
-            pages=data["pages_list"],
-            series=data["slug"],
-            chapter=data["slug"]
-        )
-
-    @api_cache(prefix="imgchest_series_page_dt", time=300)
-    def series_page_handler(self, meta_id: str) -> SeriesPage:
-        data = self.imgchest_common(meta_id)
-        return data and SeriesPage(
-            series=data["title"],
-            alt_titles=[],
-            alt_titles_str=None,
-            slug=data["slug"],
-            cover_vol_url=data["cover"],
-            metadata=[],
-            synopsis=data["description"],
-            author=data["author"],
-            chapter_list=data["chapter_list"],
-            original_url=data["original_url"]
-        )
+        return data and SeriesRecord(**data)
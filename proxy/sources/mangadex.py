@@ -1,7 +1,8 @@
+import asyncio
 from concurrent.futures.thread import ThreadPoolExecutor
 from datetime import datetime
 import html
-from typing import Dict, Optional, Union
+from typing import Dict, Union
 from django.core.cache import cache
 
 from django.http import HttpResponse
@@ -9,8 +10,10 @@ from django.shortcuts import redirect
 from django.urls import re_path
 
 from ..source import ProxySource
-from ..source.data import ChapterAPI, ProxyException, SeriesAPI, SeriesPage
-from ..source.helpers import api_cache, get_wrapper, post_wrapper
+from ..source.data import ChapterAPI, ProxyException, SeriesRecord
+from ..source.aio import async_get_wrapper
+from ..source.helpers import api_cache, get_wrapper, off_loop, post_wrapper
+from ..source.metrics import in_context
 from ..source.markdown_parser import parse_html
 
 SUPPORTED_LANG = "en"
@@ -26,6 +29,9 @@ HEADERS_COMMON = {
 
 
 class MangaDex(ProxySource):
+    async_handlers = True
+    prefetch_next_chapter = True
+
     def get_reader_prefix(self):
         return "mangadex"
 
@@ -131,72 +137,42 @@ class MangaDex(ProxySource):
             date.second,
         ]
 
-    @api_cache(prefix="md_common_dt", time=600)
-    def md_api_common(self, meta_id):
-        current_offset = 0
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            result = executor.map(
-                lambda req: {
-                    "type": req["type"],
-                    "res": get_wrapper(
-                        req["url"], headers=HEADERS_COMMON, use_proxy=True
-                    ),
-                },
-                [
-                    {
-                        "type": "main",
-                        "url": f"https://api.mangadex.org/manga/{meta_id}?includes[]=cover_art",
-                    },
-                    {
-                        "type": "chapter",
-                        "url": f"https://api.mangadex.org/manga/{meta_id}/feed?{CONTENT_RATINGS}&translatedLanguage[]={SUPPORTED_LANG}&limit=500&includeEmptyPages=0&includeFuturePublishAt=0&includeExternalUrl=0",
-                    },
-                ],
-            )
-
-        main_data = None
-        chapter_data = None
+    @staticmethod
+    def md_feed_url(meta_id, offset=0):
+        if not offset:
+            return f"https://api.mangadex.org/manga/{meta_id}/feed?{CONTENT_RATINGS}&translatedLanguage[]={SUPPORTED_LANG}&limit=500&includeEmptyPages=0&includeFuturePublishAt=0&includeExternalUrl=0"
+        return f"https://api.mangadex.org/manga/{meta_id}/feed?{CONTENT_RATINGS}&translatedLanguage[]={SUPPORTED_LANG}&offset={offset}&limit=500"
 
-        for res in result:
-            if res["res"].status_code != 200:
-                raise ProxyException(
-                    f"The MangaDex API failed to load. Got status code: {res['res'].status_code}"
-                )
-            if res["type"] == "main":
-                main_data = res["res"].json()
-            elif res["type"] == "chapter":
-                chapter_data = res["res"].json()
+    @staticmethod
+    def md_check_response(resp):
+        if resp.status_code != 200:
+            raise ProxyException(
+                f"The MangaDex API failed to load. Got status code: {resp.status_code}"
+            )
+        return resp.json()
 
+    def md_remaining_feed_urls(self, meta_id, chapter_data):
         current_offset = 500
-        if "total" in chapter_data and current_offset < chapter_data["total"]:
-            unfetched_urls = []
+        unfetched_urls = []
+        if "total" in chapter_data:
             while current_offset < chapter_data["total"]:
-                unfetched_urls.append(
-                    f"https://api.mangadex.org/manga/{meta_id}/feed?{CONTENT_RATINGS}&translatedLanguage[]={SUPPORTED_LANG}&offset={current_offset}&limit=500"
-                )
+                unfetched_urls.append(self.md_feed_url(meta_id, current_offset))
                 current_offset = current_offset + 500
+        return unfetched_urls
 
-            # workers = 3 because aren't getting 2000+ chapter series soon (hopefully)
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                results = executor.map(
-                    lambda url: get_wrapper(
-                        url=url,
-                        headers=HEADERS_COMMON,
-                        use_proxy=True,
-                    ),
-                    unfetched_urls,
-                )
-            for result in results:
-                result_json = result.json()
-                chapter_data["data"].extend(result_json["data"])
-
-        groups_set = {
+    @staticmethod
+    def md_groups_set(chapter_data):
+        return {
             relationship["id"]
             for chapter in chapter_data["data"]
             for relationship in chapter["relationships"]
             if relationship["type"] == GROUP_KEY
         }
 
+    @staticmethod
+    def md_cached_groups(groups_set):
+        """Returns the group names we already know, and the URL to look up the
+        rest with (or None if there's nothing left to resolve)."""
         resolved_groups_map = {}
 
         for group in groups_set:
@@ -209,21 +185,110 @@ class MangaDex(ProxySource):
         # since the CORS proxy doesn't handle the PHP array
         # syntax properly.
         remaining_groups = groups_set - set(resolved_groups_map)
-        if len(remaining_groups):
-            groups_api_url = f"https://api.mangadex.org/group?limit=100"
-            for group in remaining_groups:
-                groups_api_url += f"&ids[]={group}"
-            groups_resp = get_wrapper(
+        if not len(remaining_groups):
+            return resolved_groups_map, None
+        groups_api_url = f"https://api.mangadex.org/group?limit=100"
+        for group in remaining_groups:
+            groups_api_url += f"&ids[]={group}"
+        return resolved_groups_map, groups_api_url
+
+    @staticmethod
+    def md_store_groups(resolved_groups_map, groups_json):
+        for result in groups_json["data"]:
+            group_id = result["id"]
+            group_name = result["attributes"]["name"]
+            resolved_groups_map[group_id] = group_name
+            cache.set(group_id, group_name, 60 * 60 * 24)  # 24 hour cache
+
+    @api_cache(prefix="md_record_dt", time=600)
+    def series_record(self, meta_id):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            main_resp, chapter_resp = executor.map(
+                in_context(
+                    lambda url: get_wrapper(url, headers=HEADERS_COMMON, use_proxy=True)
+                ),
+                [
+                    f"https://api.mangadex.org/manga/{meta_id}?includes[]=cover_art",
+                    self.md_feed_url(meta_id),
+                ],
+            )
+        main_data = self.md_check_response(main_resp)
+        chapter_data = self.md_check_response(chapter_resp)
+
+        unfetched_urls = self.md_remaining_feed_urls(meta_id, chapter_data)
+        if unfetched_urls:
+            # workers = 3 because aren't getting 2000+ chapter series soon (hopefully)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                results = executor.map(
+                    in_context(
+                        lambda url: get_wrapper(
+                            url=url,
+                            headers=HEADERS_COMMON,
+                            use_proxy=True,
+                        )
+                    ),
+                    unfetched_urls,
+                )
+            for result in results:
+                result_json = result.json()
+                chapter_data["data"].extend(result_json["data"])
+
+        groups_set = self.md_groups_set(chapter_data)
+        resolved_groups_map, groups_api_url = self.md_cached_groups(groups_set)
+        if groups_api_url:
+            groups_resp = get_wrapper(groups_api_url, headers=HEADERS_COMMON)
+            if groups_resp.status_code != 200:
+                return
+            self.md_store_groups(resolved_groups_map, groups_resp.json())
+
+        return self.md_parse_common(
+            meta_id, main_data, chapter_data, groups_set, resolved_groups_map
+        )
+
+    @api_cache(prefix="md_record_dt", time=600)
+    async def series_record_async(self, meta_id):
+        main_resp, chapter_resp = await asyncio.gather(
+            *(
+                async_get_wrapper(url, headers=HEADERS_COMMON, use_proxy=True)
+                for url in [
+                    f"https://api.mangadex.org/manga/{meta_id}?includes[]=cover_art",
+                    self.md_feed_url(meta_id),
+                ]
+            )
+        )
+        main_data = self.md_check_response(main_resp)
+        chapter_data = self.md_check_response(chapter_resp)
+
+        results = await asyncio.gather(
+            *(
+                async_get_wrapper(url, headers=HEADERS_COMMON, use_proxy=True)
+                for url in self.md_remaining_feed_urls(meta_id, chapter_data)
+            )
+        )
+        for result in results:
+            chapter_data["data"].extend(result.json()["data"])
+
+        groups_set = self.md_groups_set(chapter_data)
+        resolved_groups_map, groups_api_url = await off_loop(self.md_cached_groups)(
+            groups_set
+        )
+        if groups_api_url:
+            groups_resp = await async_get_wrapper(
                 groups_api_url, headers=HEADERS_COMMON
             )
             if groups_resp.status_code != 200:
                 return
-            for result in groups_resp.json()["data"]:
-                group_id = result["id"]
-                group_name = result["attributes"]["name"]
-                resolved_groups_map[group_id] = group_name
-                cache.set(group_id, group_name, 60 * 60 * 24)  # 24 hour cache
+            await off_loop(self.md_store_groups)(
+                resolved_groups_map, groups_resp.json()
+            )
 
+        return self.md_parse_common(
+            meta_id, main_data, chapter_data, groups_set, resolved_groups_map
+        )
+
+    def md_parse_common(
+        self, meta_id, main_data, chapter_data, groups_set, resolved_groups_map
+    ):
         groups_dict = {}
         groups_map = {}
 
@@ -346,68 +411,29 @@ class MangaDex(ProxySource):
             else "No description."
         )
 
-        return {
-            "slug": meta_id,
-            "title": title,
-            "description": description,
-            "author": "",
-            "artist": "",
-            "groups": groups_dict,
-            "chapter_dict": chapter_dict,
-            "chapter_list": chapter_list,
-            "cover": f"https://uploads.mangadex.org/covers/{meta_id}/{cover_filename}",
-        }
-
-    @api_cache(prefix="md_series_dt", time=600)
-    def series_api_handler(self, meta_id):
-        data = self.md_api_common(meta_id)
-        if data:
-            return SeriesAPI(
-                slug=data["slug"],
-                title=data["title"],
-                description=data["description"],
-                author=data["author"],
-                artist=data["artist"],
-                groups=data["groups"],
-                cover=data["cover"],
-                chapters=data["chapter_dict"],
-            )
+        return SeriesRecord(
+            slug=meta_id,
+            title=title,
+            description=description,
+            author="",
+            artist="",
+            groups=groups_dict,
+            chapter_dict=chapter_dict,
+            chapter_list=chapter_list,
+            cover=f"https://uploads.mangadex.org/covers/{meta_id}/{cover_filename}",
+            original_url=f"https://mangadex.org/title/{meta_id}",
+        )
 
-    @api_cache(prefix="md_chapter_dt", time=300)
-    def chapter_api_handler(self, meta_id):
-        at_home: str = "at-home"
-        chapter: str = "chapter"
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            result = executor.map(
-                lambda req: {
-                    "type": req["type"],
-                    "res": get_wrapper(
-                        req["url"], headers=HEADERS_COMMON, use_proxy=True
-                    ),
-                },
-                [
-                    {
-                        "type": at_home,
-                        "url": f"https://api.mangadex.org/at-home/server/{meta_id}?forcePort443=true",
-                    },
-                    {
-                        "type": chapter,
-                        "url": f"https://api.mangadex.org/chapter/{meta_id}",
-                    },
-                ],
-            )
+    @staticmethod
+    def md_chapter_urls(meta_id):
+        return [
+            f"https://api.mangadex.org/at-home/server/{meta_id}?forcePort443=true",
+            f"https://api.mangadex.org/chapter/{meta_id}",
+        ]
 
-        at_home_data: Optional[Dict[str, str]] = None
-        chapter_data: Optional[Dict[str, str]] = None
-        for res in result:
-            if res["res"].status_code != 200:
-                raise ProxyException(
-                    f"The MangaDex API failed to load. Got status code: {res['res'].status_code}"
-                )
-            if res["type"] == at_home:
-                at_home_data = res["res"].json()
-            elif res["type"] == chapter:
-                chapter_data = res["res"].json()
+    def md_parse_chapter(self, at_home_resp, chapter_resp):
+        at_home_data: Dict[str, str] = self.md_check_response(at_home_resp)
+        chapter_data: Dict[str, str] = self.md_check_response(chapter_resp)
 
         pages = [
             f"{at_home_data['baseUrl']}/data/{at_home_data['chapter']['hash']}/{page}"
@@ -422,19 +448,31 @@ class MangaDex(ProxySource):
 
         return ChapterAPI(pages=pages, series=series, chapter=chapter)
 
-    @api_cache(prefix="md_series_page_dt", time=600)
-    def series_page_handler(self, meta_id):
-        data = self.md_api_common(meta_id)
-        if data:
-            return SeriesPage(
-                series=data["title"],
-                alt_titles=[],
-                alt_titles_str=None,
-                slug=data["slug"],
-                cover_vol_url=data["cover"],
-                metadata=[],
-                synopsis=data["description"],
-                author=data["artist"],
-                chapter_list=data["chapter_list"],
-                original_url=f"https://mangadex.org/title/{data['slug']}",
+    async def series_api_handler_async(self, meta_id):
+        record = await self.series_record_async(meta_id)
+        return record and record.series_api()
+
+    @api_cache(prefix="md_chapter_dt", time=300)
+    def chapter_api_handler(self, meta_id):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            at_home_resp, chapter_resp = executor.map(
+                in_context(
+                    lambda url: get_wrapper(url, headers=HEADERS_COMMON, use_proxy=True)
+                ),
+                self.md_chapter_urls(meta_id),
+            )
+        return self.md_parse_chapter(at_home_resp, chapter_resp)
+
+    @api_cache(prefix="md_chapter_dt", time=300)
+    async def chapter_api_handler_async(self, meta_id):
+        at_home_resp, chapter_resp = await asyncio.gather(
+            *(
+                async_get_wrapper(url, headers=HEADERS_COMMON, use_proxy=True)
+                for url in self.md_chapter_urls(meta_id)
             )
+        )
+        return self.md_parse_chapter(at_home_resp, chapter_resp)
+
+    async def series_page_handler_async(self, meta_id):
+        record = await self.series_record_async(meta_id)
+        return record and record.series_page()
@@ -6,7 +6,7 @@ from django.shortcuts import redirect
 from django.urls.conf import re_path
 
 from ..source import ProxySource
-from ..source.data import ChapterAPI, SeriesAPI, SeriesPage
+from ..source.data import ChapterAPI, SeriesRecord
 from ..source.helpers import api_cache, get_wrapper, encode, decode
 
 
@@ -44,8 +44,8 @@ class MangAdventure(ProxySource):
             re_path(r"^ma/(?P<raw_url>[\w\d/:.-]+)", handler),
         ]
 
-    @api_cache(prefix="ma_series_dt", time=600)
-    def series_api_handler(self, meta_id: str):
+    @api_cache(prefix="ma_record_dt", time=600)
+    def series_record(self, meta_id: str):
         scheme, domain, slug = decode(meta_id).split("/", 2)
         if domain not in self.whitelist:
             return None
@@ -81,7 +81,17 @@ class MangAdventure(ProxySource):
                 group: int(chapter["last_updated"])
             }
 
-        return SeriesAPI(
+        chapter_list = [[
+            chapter["number"],
+            ch_id,
+            chapter["title"],
+            ch_id,
+            list(chapter["groups"].keys())[0],
+            self.parse_date(chapter["last_updated"]),
+            chapter["volume"],
+        ] for ch_id, chapter in reversed(data["chapters"].items())]
+
+        return SeriesRecord(
             slug=meta_id,
             title=data["title"],
             description=data["description"],
@@ -89,11 +99,14 @@ class MangAdventure(ProxySource):
             artist=data["artist"],
             groups=groups,
             cover=data["cover"],
-            chapters=chapters,
-            series_name=data["title"]
+            chapter_dict=chapters,
+            chapter_list=chapter_list,
+            alt_titles=data["alt_titles"],
+            metadata=data["metadata"],
+            original_url=f"{scheme}://{domain}{data['original_url']}",
         )
 
-    @api_cache(prefix="ma_series_page_dt", time=600)
+    @api_cache(prefix="ma_chapter_dt", time=600)
     def chapter_api_handler(self, meta_id: str):
         scheme, domain, slug, id = decode(meta_id).split("/", 3)
         if domain not in self.whitelist:
@@ -105,42 +118,6 @@ class MangAdventure(ProxySource):
         pages = [page["image"] for page in res.json()["results"]]
         return ChapterAPI(series=slug, pages=pages, chapter=id)
 
-    @api_cache(prefix="ma_series_page_dt", time=600)
-    def series_page_handler(self, meta_id: str):
-        scheme, domain, slug = decode(meta_id).split("/", 2)
-        if domain not in self.whitelist:
-            return None
-        url = f"{scheme}://{domain}/api/v2/cubari/{slug}"
-        res = get_wrapper(url, headers=self.headers)
-        if res.status_code != 200:
-            return None
-        data = res.json()
-
-        origin = f"{scheme}://{domain}{data['original_url']}"
-        # simplified version of the gist mapper
-        chapters = [[
-            chapter["number"],
-            ch_id,
-            chapter["title"],
-            ch_id,
-            list(chapter["groups"].keys())[0],
-            self.parse_date(chapter["last_updated"]),
-            chapter["volume"],
-        ] for ch_id, chapter in reversed(data["chapters"].items())]
-
-        return SeriesPage(
-            series=data["title"],
-            alt_titles=data["alt_titles"],
-            alt_titles_str=None,
-            slug=meta_id,
-            cover_vol_url=data["cover"],
-            metadata=data["metadata"],
-            synopsis=data["description"],
-            author=data["author"],
-            chapter_list=chapters,
-            original_url=origin,
-        )
-
     @staticmethod
     def parse_date(timestamp: str) -> list:
         date = dt.utcfromtimestamp(int(timestamp)).timetuple()
@@ -10,6 +10,9 @@ from ..source.helpers import api_cache, get_wrapper
 
 
 class NepNep(ProxySource):
+    prefetch_next_chapter = True
+    warm_handlers = ("nn_scrape_common", "series_api_handler")
+
     def get_reader_prefix(self):
         return "weebcentral"
 
@@ -148,8 +151,8 @@ class NepNep(ProxySource):
         else:
             return None
 
-    def series_api_handler(self, meta_id):
-        data = self.nn_scrape_common(meta_id)
+    @staticmethod
+    def nn_series_api(data):
         if data:
             return SeriesAPI(
                 slug=data["slug"],
@@ -164,6 +167,15 @@ class NepNep(ProxySource):
         else:
             return None
 
+    @api_cache(prefix="nn_series_dt", time=600)
+    def series_api_handler(self, meta_id):
+        return self.nn_series_api(self.nn_scrape_common(meta_id))
+
+    def cached_series_api(self, meta_id):
+        return self.series_api_handler.peek(self, meta_id) or self.nn_series_api(
+            self.nn_scrape_common.peek(self, meta_id)
+        )
+
     @api_cache(prefix="nn_chapter_dt", time=3600)
     def chapter_api_handler(self, meta_id):
         url = 'https://weebcentral.com/chapters/' + meta_id + \
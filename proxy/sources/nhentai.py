@@ -11,6 +11,8 @@ from ..source.helpers import api_cache, encode, get_wrapper
 
 
 class NHentai(ProxySource):
+    warm_handlers = ("nh_api_common", "series_api_handler", "series_page_handler")
+
     def cache_duration(self) -> int:
         return 60 * 60 * 60 * 6
 
@@ -9,6 +9,7 @@ from django.urls import re_path
 from ..source import ProxySource
 from ..source.data import ChapterAPI, SeriesAPI, SeriesPage
 from ..source.helpers import api_cache, get_wrapper, decode, encode
+from ..source.metrics import in_context
 
 
 class ReadManhwa(ProxySource):
@@ -61,12 +62,16 @@ class ReadManhwa(ProxySource):
     def series_api_handler(self, meta_id):
         with futures.ThreadPoolExecutor(max_workers=2) as executor:
             result = executor.map(
-                lambda req: {
-                    "type": req["type"],
-                    "res": get_wrapper(
-                        req["url"], headers={"X-NSFW": "true"}, params={"nsfw": "true"}
-                    ),
-                },
+                in_context(
+                    lambda req: {
+                        "type": req["type"],
+                        "res": get_wrapper(
+                            req["url"],
+                            headers={"X-NSFW": "true"},
+                            params={"nsfw": "true"},
+                        ),
+                    }
+                ),
                 [
                     {
                         "type": "main",
@@ -154,12 +159,16 @@ class ReadManhwa(ProxySource):
     def series_page_handler(self, meta_id):
         with futures.ThreadPoolExecutor(max_workers=2) as executor:
             result = executor.map(
-                lambda req: {
-                    "type": req["type"],
-                    "res": get_wrapper(
-                        req["url"], headers={"X-NSFW": "true"}, params={"nsfw": "true"}
-                    ),
-                },
+                in_context(
+                    lambda req: {
+                        "type": req["type"],
+                        "res": get_wrapper(
+                            req["url"],
+                            headers={"X-NSFW": "true"},
+                            params={"nsfw": "true"},
+                        ),
+                    }
+                ),
                 [
                     {
                         "type": "main",
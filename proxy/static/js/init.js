@@ -77,7 +77,7 @@ function ReaderAPI(o) {
 	this.data = {};
 	this.indexData = {};
 
-	this.infuseSeriesData = function(data) {
+	this.infuseSeriesData = function(data, slug) {
 		for(var num in data.chapters) {
 		let chapter = data.chapters[num];
 			chapter.images = {};
@@ -98,7 +98,7 @@ function ReaderAPI(o) {
 				if (this.firstParty) {
 					firstPartySeriesHandler(this.mediaURL, chapter, group, data.slug);
 				} else {
-					thirdPartySeriesHandler(this.seriesUrl, chapter, group);
+					thirdPartySeriesHandler(this.seriesUrl, chapter, group, slug);
 				}
 			}
 		}
@@ -118,7 +118,7 @@ function ReaderAPI(o) {
 		this.seriesRequest = fetch(this.seriesUrl + slug + '/')
 			.then(response => response.json())
 			.then(seriesData => {
-				seriesData = this.infuseSeriesData(seriesData);
+				seriesData = this.infuseSeriesData(seriesData, slug);
 				seriesData.chaptersIndex =
 					Object.keys(
 						seriesData.chapters
@@ -1336,6 +1336,52 @@ function UI_Reader(o) {
 		});
 	}
 
+	// Loads the pages of many chapters through the source's batch endpoint,
+	// instead of one request per chapter, in requests of at most
+	// CHAPTER_BATCH_MAX chapters. Whatever the batch couldn't resolve keeps
+	// its pageRequest, so fetchChapter falls back to it as usual.
+	this.fetchChapters = async function(chapters) {
+		if (!CHAPTER_BATCH_MAX) return;
+		let batches = {};
+		for (let chapter of chapters) {
+			let targetChapter = this.current.chapters[chapter];
+			let group = this.getGroup(chapter);
+			if (targetChapter.loaded[group] || !targetChapter.pageRequest
+				|| !targetChapter.pageRequest[group]) continue;
+			let match = /^(.*\/)chapter\/([^/]+)\/$/.exec(targetChapter.groups[group]);
+			if (!match) continue;
+			let batchURL = match[1] + 'chapters/';
+			if (!batches[batchURL]) batches[batchURL] = {};
+			batches[batchURL][decodeURIComponent(match[2])] = {targetChapter, group};
+		}
+		await Promise.all(Object.entries(batches).map(async ([batchURL, batch]) => {
+			let metaIDs = Object.keys(batch);
+			for (let i = 0; i < metaIDs.length; i += CHAPTER_BATCH_MAX) {
+				try {
+					let pages = await fetch(batchURL, {
+							method: 'POST',
+							headers: {'Content-Type': 'application/json'},
+							body: JSON.stringify({chapters: metaIDs.slice(i, i + CHAPTER_BATCH_MAX)})
+						})
+						.then(r => {
+							if (!r.ok) throw new Error(`Chapter batch failed with ${r.status}`);
+							return r.json();
+						});
+					for (let metaID in pages) {
+						if (!pages[metaID] || !batch[metaID]) continue;
+						let {targetChapter, group} = batch[metaID];
+						if (targetChapter.loaded[group]) continue;
+						thirdPartyPagesHandler(targetChapter, group, pages[metaID]);
+						delete targetChapter.pageRequest[group];
+						targetChapter.loaded[group] = true;
+					}
+				} catch (e) {
+					console.log(e);
+				}
+			}
+		}));
+	}
+
 	this.initChapter = function(chapter, page, group) {
 		if (chapter) this.SCP.chapter = chapter;
 		this.loadingChapter = true;
@@ -1772,7 +1818,10 @@ function UI_Reader(o) {
 	this._.share_button.onmousedown = e => this.copyShortLink(e);
 	this._.search.onclick = e => Loda.display('search');
 	this._.jump.onclick = e => Loda.display('jump');
-	this._.download_chapter.onclick = () => DownloadManagerObj.downloadChapter();
+	// Shift-click downloads the whole series.
+	this._.download_chapter.onclick = (e) => e.shiftKey
+		? DownloadManagerObj.downloadSeries()
+		: DownloadManagerObj.downloadChapter();
 	this._.download_cancel.onclick = () => DownloadManagerObj.cancelDownload();
 	this._.random_chapter_button.addEventListener('mousedown', e => {
 		e.preventDefault();
@@ -3651,7 +3700,7 @@ function firstPartySeriesHandler(mediaURL, chapter, group, slug) {
 }
 
 // NH API response returns an array, whereas others returns a chapter ID
-function thirdPartySeriesHandler(url, chapter, group) {
+function thirdPartySeriesHandler(url, chapter, group, slug) {
 	if (Array.isArray(chapter.groups[group])) {
 		// TODO page handling is pretty ugly here. I'd recommend a refactor someday.
 		for (let i = 0; i < chapter.groups[group].length; i++) {
@@ -3674,29 +3723,14 @@ function thirdPartySeriesHandler(url, chapter, group) {
 		if (!chapter.pageRequest) chapter.pageRequest = {};
 		chapter.loaded[group] = false;
 		chapter.pageRequest[group] = async () => {
-			let images = chapter.images[group];
-			let wides = chapter.wides[group];
-			let descriptions = chapter.descriptions[group];
 			try {
 				// Each group/chapter pair has a unique ID, returned by API
-				let pages = await fetch(`${chapter.groups[group]}`)
+				// The series lets the proxy warm up the chapter after this one.
+				let pages = await fetch(`${chapter.groups[group]}`, {
+									headers: {'X-Cubari-Series': slug}
+								})
 								.then(r => r.json());
-				pages.forEach((p, i) => {
-					if (typeof p === 'string' || p instanceof String) {
-						images.push(p);
-						if (p.includes(WIDE_FLAG)) {
-							wides.push(i);
-						}
-					} else {
-						descriptions.push(p.description);
-						images.push(p.src);
-						if (p.src.includes(WIDE_FLAG)) {
-							wides.push(i);
-						}
-
-					}
-				});
-				return pages.length;
+				return thirdPartyPagesHandler(chapter, group, pages);
 			} catch (e) {
 				console.log(e);
 				return 0;
@@ -3705,9 +3739,37 @@ function thirdPartySeriesHandler(url, chapter, group) {
 	}
 }
 
+function thirdPartyPagesHandler(chapter, group, pages) {
+	let images = chapter.images[group];
+	let wides = chapter.wides[group];
+	let descriptions = chapter.descriptions[group];
+	pages.forEach((p, i) => {
+		if (typeof p === 'string' || p instanceof String) {
+			images.push(p);
+			if (p.includes(WIDE_FLAG)) {
+				wides.push(i);
+			}
+		} else {
+			descriptions.push(p.description);
+			images.push(p.src);
+			if (p.src.includes(WIDE_FLAG)) {
+				wides.push(i);
+			}
+
+		}
+	});
+	return pages.length;
+}
+
 function DownloadManager() {
 	this.chapterDownloadURL = "";
 	let latestRef;
+	const mimeMap = {
+		'image/gif': '.gif',
+		'image/jpeg': '.jpg',
+		'image/png': '.png',
+		'image/webp': '.webp',
+	}
 	this.downloadChapter = async function() {
 		// Shenanigans to allow download cancellation
 		let localRef = latestRef = Reader.SCP.chapter;
@@ -3718,12 +3780,6 @@ function DownloadManager() {
 		Reader._.download_chapter.classList.add("hidden");
 		Reader._.downloading_chapter.textContent = `Ch.${chapter} : 0%`;
 		Reader._.download_wrapper.classList.remove("hidden");
-		let mimeMap = {
-			'image/gif': '.gif',
-			'image/jpeg': '.jpg',
-			'image/png': '.png',
-			'image/webp': '.webp',
-		}
 		await Reader.fetchChapter(chapter)
 		let chapURLArray = Reader.SCP.chapterObject.images[Reader.getGroup(chapter)];
 		if (await shouldUseProxy(chapURLArray[0])) {
@@ -3772,6 +3828,71 @@ function DownloadManager() {
 		}
 	}
 
+	this.downloadSeries = async function() {
+		let localRef = latestRef = Symbol("series");
+		if(this.chapterDownloadURL) {
+			URL.revokeObjectURL(this.chapterDownloadURL)
+		}
+		Reader._.download_chapter.classList.add("hidden");
+		Reader._.downloading_chapter.textContent = `0%`;
+		Reader._.download_wrapper.classList.remove("hidden");
+
+		try {
+			let chapters = Reader.current.chaptersIndex;
+			// One round trip for every chapter's page list.
+			await Reader.fetchChapters(chapters);
+			let downloads = [];
+			for (let chapter of chapters) {
+				await Reader.fetchChapter(chapter);
+				if (latestRef !== localRef) throw { name: "changedRef" };
+				let chapURLArray = Reader.current.chapters[chapter].images[Reader.getGroup(chapter)];
+				chapURLArray.forEach((url, index) => downloads.push({
+					url,
+					"folder": chapter,
+					"fileIndex": String(index + 1).padStart(String(chapURLArray.length).length, "0"),
+				}));
+			}
+			if (downloads.length && await shouldUseProxy(downloads[0].url)) {
+				downloads.forEach((download) => {
+					download.url = `${IMAGE_PROXY_URL}/v1/image/${btoa(download.url).replace(/\+/g, "-").replace(/\//g, "_")}?source=reader_download`;
+				});
+			}
+
+			let parallelDownloads = Settings.get("adv.parallelDownloads");
+			let zip = new JSZip();
+			let progress = 0;
+			for (let i = 0; i < downloads.length; i += parallelDownloads) {
+				let imageBlobs = await Promise.all(
+					downloads
+					.slice(i, i + parallelDownloads)
+					.map(async (download) => {
+						let contents = await downloadHandler(download.url);
+						if (latestRef !== localRef) throw { name: "changedRef" };
+						progress++;
+						Reader._.downloading_chapter.textContent = `${Math.round(progress / downloads.length * 98)}%`;
+						return {...download, contents};
+					})
+				);
+
+				imageBlobs.forEach((data) => {
+					zip.folder(data.folder).file(data.fileIndex + mimeMap[data.contents.type], data.contents, { binary: true });
+				});
+			}
+
+			let zipBlob = await zip.generateAsync({type:"blob"});
+
+			this.chapterDownloadURL = URL.createObjectURL(zipBlob);
+			if (latestRef === localRef) initiateDownload(this.chapterDownloadURL, filename = Reader.SCP.series + ".zip");
+
+		} catch (err) {
+			if (err.name !== "changedRef") {
+				TooltippyError.set("An error occured while downloading: " + err.message);
+			}
+		} finally {
+			wrapUp(ref = localRef)
+		}
+	}
+
 	async function shouldUseProxy(testUrl) {
 		// We don't know the actual error so we'll play it
 		// safe and assume this error is due to CORS
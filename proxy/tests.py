@@ -1,3 +1,604 @@
-from django.test import TestCase
+import json
+import pickle
+import threading
+from time import monotonic, sleep
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from ratelimit.exceptions import Ratelimited
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .popularity import proxy_hits
+from .views import metrics
+from .source import ProxySource, breaker, helpers, metrics as source_metrics, sessions
+from .source.data import (
+    ChapterAPI,
+    ChapterMap,
+    FrozenMap,
+    ProxyBusyException,
+    ProxyException,
+    SeriesAPI,
+    SeriesRecord,
+)
+from .source.helpers import API_CACHE_LOCK_PREFIX, api_cache, local_cache
+from .source.local_cache import LocalLRUCache
+
+
+class FakeSource:
+    """Stands in for a ProxySource, with a cached handler that counts its calls
+    and can be held up until a test releases it."""
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_reader_prefix(self):
+        return "fake"
+
+    def fetch(self, meta_id):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    @api_cache(prefix="fake_dt", time=60)
+    def handler(self, meta_id):
+        return self.fetch(meta_id)
+
+    @api_cache(prefix="fake_no_negative_dt", time=60, negative=0)
+    def uncached_failure_handler(self, meta_id):
+        return self.fetch(meta_id)
+
+    @api_cache(prefix="fake_async_dt", time=60)
+    async def async_handler(self, meta_id):
+        return self.fetch(meta_id)
+
+    # Goes stale as soon as it's stored.
+    @api_cache(prefix="fake_stale_dt", time=0)
+    def stale_handler(self, meta_id):
+        return self.fetch(meta_id)
+
+
+class ApiCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        helpers._next_generation_check = 0
+
+
+class CoalescingTests(ApiCacheTestCase):
+    def test_concurrent_misses_fetch_once(self):
+        source = FakeSource({"pages": [1, 2]})
+        source.release.clear()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(source.handler("x")))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        source.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(source.calls, 1)
+        self.assertEqual(results, [{"pages": [1, 2]}] * 4)
+
+    def test_lease_is_released_after_fetch(self):
+        FakeSource({"pages": []}).handler("x")
+        self.assertIsNone(cache.get(f"{API_CACHE_LOCK_PREFIX}fake_dt_x"))
+
+    def test_follower_takes_over_an_abandoned_lease(self):
+        source = FakeSource({"pages": [1]})
+        cache.set(f"{API_CACHE_LOCK_PREFIX}fake_dt_x", "gone", 1)
+        self.assertEqual(source.handler("x"), {"pages": [1]})
+        self.assertEqual(source.calls, 1)
+
+
+class NegativeCacheTests(ApiCacheTestCase):
+    def test_failure_replayed_without_refetching(self):
+        source = FakeSource(ProxyException("not found"))
+        for _ in range(2):
+            with self.assertRaisesMessage(ProxyException, "not found"):
+                source.handler("x")
+        self.assertEqual(source.calls, 1)
+
+    def test_empty_result_remembered(self):
+        source = FakeSource(None)
+        self.assertIsNone(source.handler("x"))
+        self.assertIsNone(source.handler("x"))
+        self.assertEqual(source.calls, 1)
+
+    def test_busy_failures_not_remembered(self):
+        source = FakeSource(ProxyBusyException("busy"))
+        for _ in range(2):
+            with self.assertRaises(ProxyBusyException):
+                source.handler("x")
+        self.assertEqual(source.calls, 2)
+
+    def test_negative_zero_disables(self):
+        source = FakeSource(ProxyException("not found"))
+        for _ in range(2):
+            with self.assertRaises(ProxyException):
+                source.uncached_failure_handler("x")
+        self.assertEqual(source.calls, 2)
+
+
+class AsyncApiCacheTests(ApiCacheTestCase):
+    async def test_async_handler_caches(self):
+        source = FakeSource({"v": 1})
+        self.assertEqual(await source.async_handler("x"), {"v": 1})
+        self.assertEqual(await source.async_handler("x"), {"v": 1})
+        self.assertEqual(source.calls, 1)
+        self.assertIsNone(cache.get(f"{API_CACHE_LOCK_PREFIX}fake_async_dt_x"))
+
+    async def test_async_failure_remembered(self):
+        source = FakeSource(ProxyException("not found"))
+        for _ in range(2):
+            with self.assertRaisesMessage(ProxyException, "not found"):
+                await source.async_handler("x")
+        self.assertEqual(source.calls, 1)
+
+
+class StaleTests(ApiCacheTestCase):
+    @override_settings(PROXY_CACHE_BACKGROUND_REFRESH=False)
+    def test_stale_value_served_when_refresh_fails(self):
+        source = FakeSource({"v": 1})
+        source.stale_handler("x")
+        source.result = ProxyException("down")
+        self.assertEqual(source.stale_handler("x"), {"v": 1})
+        self.assertEqual(source.calls, 2)
+
+    @override_settings(PROXY_CACHE_BACKGROUND_REFRESH=False)
+    def test_stale_value_refreshed_inline(self):
+        source = FakeSource({"v": 1})
+        source.stale_handler("x")
+        source.result = {"v": 2}
+        self.assertEqual(source.stale_handler("x"), {"v": 2})
+
+    @override_settings(PROXY_CACHE_BACKGROUND_REFRESH=True)
+    def test_stale_value_served_while_refreshing(self):
+        source = FakeSource({"v": 1})
+        source.stale_handler("x")
+        source.result = {"v": 2}
+        self.assertEqual(source.stale_handler("x"), {"v": 1})
+        deadline = monotonic() + 5
+        while cache.get("fake_stale_dt_x").data != {"v": 2}:
+            self.assertLess(monotonic(), deadline)
+            sleep(0.01)
+
+
+class LocalCacheTests(ApiCacheTestCase):
+    def test_evicts_by_given_size(self):
+        lru = LocalLRUCache(max_entries=10, max_bytes=100, ttl=10)
+        lru.set("a", "x", size=60)
+        lru.set("b", "y", size=60)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.get("b"), "y")
+        self.assertEqual(lru.stats()["bytes"], 60)
+
+    def test_stored_entry_carries_its_size(self):
+        FakeSource({"pages": [1, 2]}).handler("x")
+        self.assertGreater(cache.get("fake_dt_x").size, 0)
+        self.assertEqual(local_cache.stats()["bytes"], cache.get("fake_dt_x").size)
+
+    def test_cache_clear_drops_local_entries(self):
+        source = FakeSource({"v": 1})
+        source.handler("x")
+        cache.clear()
+        helpers._next_generation_check = 0
+        source.result = {"v": 2}
+        self.assertEqual(source.handler("x"), {"v": 2})
+        self.assertEqual(source.calls, 2)
+
+    def test_clear_local_caches_keeps_shared_entries(self):
+        source = FakeSource({"v": 1})
+        source.handler("x")
+        helpers.clear_local_caches()
+        self.assertEqual(source.handler("x"), {"v": 1})
+        self.assertEqual(source.calls, 1)
+        self.assertEqual(local_cache.stats()["entries"], 1)
+
+
+def make_record(last_updated="1600000000"):
+    return SeriesRecord(
+        slug="x",
+        title="Series",
+        description="About the series. " * 100,
+        author="Author",
+        artist="Artist",
+        cover="",
+        groups={"1": "Group"},
+        chapter_dict={
+            "1": {
+                "volume": "1",
+                "title": "Start",
+                "groups": {"1": ["a.png", "b.png"]},
+                "last_updated": last_updated,
+            }
+        },
+    )
+
+
+class RecordSource(ProxySource):
+    def __init__(self, record):
+        self.record = record
+        self.fetches = 0
+
+    def get_reader_prefix(self):
+        return "fake"
+
+    def shortcut_instantiator(self):
+        return []
+
+    @api_cache(prefix="fake_record_dt", time=60)
+    def series_record(self, meta_id):
+        self.fetches += 1
+        return self.record
+
+
+@override_settings(HIT_FLUSH_INTERVAL=3600)
+class ConditionalResponseTests(ApiCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.source = RecordSource(make_record())
+
+    def tearDown(self):
+        proxy_hits.reset()
+
+    def test_json_etag_revalidates(self):
+        response = self.source.series_api_view(self.factory.get("/"), "x")
+        self.assertEqual(response.status_code, 200)
+        response = self.source.series_api_view(
+            self.factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]), "x"
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_json_etag_differs_by_encoding(self):
+        identity = self.source.series_api_view(self.factory.get("/"), "x")
+        gzipped = self.source.series_api_view(
+            self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip"), "x"
+        )
+        self.assertNotEqual(identity["ETag"], gzipped["ETag"])
+
+    def test_html_etag_follows_static_version(self):
+        etag = self.source._html_etag(1600000000)
+        with self.settings(STATIC_VERSION="?v=other\n"):
+            self.assertNotEqual(self.source._html_etag(1600000000), etag)
+        self.assertIsNone(self.source._html_etag(None))
+
+    def test_last_modified_without_preparing(self):
+        view = make_record().series_api()
+        self.assertEqual(view.get_last_modified(), 1600000000)
+        self.assertIsNone(view.bodies)
+
+
+class SeriesRecordTests(SimpleTestCase):
+    def test_prepared_series_api_survives_pickling(self):
+        record = make_record().prepare()
+        unpickled = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        view = unpickled.series_api()
+        self.assertIsNotNone(view.bodies)
+        self.assertEqual(view.etag, record.series_api().etag)
+        self.assertIs(view.chapters, unpickled.chapter_dict)
+
+    def test_unprepared_views_not_pickled(self):
+        record = make_record()
+        record.series_api()
+        unpickled = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        self.assertIsNone(unpickled.series_api().bodies)
+
+    def test_pickled_size_bounded(self):
+        record = SeriesRecord(
+            slug="x",
+            title="Series",
+            description="About the series. " * 100,
+            author="Author",
+            artist="Artist",
+            cover="",
+            groups={str(group): f"Group {group}" for group in range(20)},
+            chapter_dict={
+                str(chapter): {
+                    "volume": str(chapter // 10),
+                    "title": f"Chapter {chapter}",
+                    "groups": {str(chapter % 20): f"/read/api/x/{chapter}/"},
+                    "last_updated": str(1600000000 + chapter),
+                }
+                for chapter in range(1500)
+            },
+        )
+        unprepared_size = len(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        record.prepare()
+        bodies = record.series_api().bodies
+        pickled = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        smallest = min(len(bodies[coding]) for coding in bodies)
+        self.assertLess(len(pickled), unprepared_size + smallest + 1024)
+
+        unpickled = pickle.loads(pickled).series_api().bodies
+        self.assertEqual(list(unpickled), list(bodies))
+        for coding in bodies:
+            self.assertEqual(unpickled[coding], bodies[coding])
+
+    def test_null_chapter_keys_kept(self):
+        chapters = {
+            "1": {
+                "volume": "1",
+                "title": "",
+                "groups": {"1": "/read/api/x/1/"},
+                "last_updated": None,
+            },
+            "2": {"volume": "1", "title": "", "groups": {"1": "/read/api/x/2/"}},
+        }
+        view = SeriesAPI(
+            slug="x",
+            title="Series",
+            description="",
+            author="",
+            artist="",
+            groups={"1": "Group"},
+            cover="",
+            chapters=chapters,
+        )
+        self.assertEqual(json.loads(view.serialize())["chapters"], chapters)
+
+
+class FrozenMapTests(SimpleTestCase):
+    def test_lookups(self):
+        for size in (3, 100):
+            frozen = FrozenMap.from_value({str(i): i for i in range(size)})
+            self.assertEqual(frozen[str(size - 1)], size - 1)
+            self.assertIn("0", frozen)
+            self.assertNotIn("missing", frozen)
+            self.assertIsNone(frozen.get("missing"))
+            with self.assertRaises(KeyError):
+                frozen["missing"]
+
+    def test_chapter_map_round_trips(self):
+        chapters = make_record().chapter_dict
+        unpickled = pickle.loads(pickle.dumps(chapters, pickle.HIGHEST_PROTOCOL))
+        self.assertIsInstance(unpickled, ChapterMap)
+        self.assertEqual(unpickled.to_dict(), chapters.to_dict())
+
+
+class PrefetchTests(ApiCacheTestCase):
+    def test_cached_series_api_never_fetches(self):
+        source = RecordSource(make_record())
+        self.assertIsNone(source.cached_series_api("x"))
+        self.assertEqual(source.fetches, 0)
+
+    def test_cached_series_api_reads_the_cache(self):
+        source = RecordSource(make_record())
+        source.series_api_handler("x")
+        self.assertEqual(source.cached_series_api("x").slug, "x")
+        self.assertEqual(source.fetches, 1)
+
+
+class NextChapterTests(SimpleTestCase):
+    def setUp(self):
+        self.source = RecordSource(make_record())
+        url = self.source.wrap_chapter_meta
+        self.data = SeriesAPI(
+            slug="x",
+            title="Series",
+            description="",
+            author="",
+            artist="",
+            groups={"1": "One", "2": "Two"},
+            cover="",
+            chapters={
+                "1": {
+                    "volume": "1",
+                    "title": "",
+                    "groups": {"1": url("a1"), "2": url("b1")},
+                },
+                "2": {"volume": "1", "title": "", "groups": {"1": url("a2")}},
+                "extra": {"volume": "1", "title": "", "groups": {"2": url("bx")}},
+                "10": {"volume": "2", "title": "", "groups": {"2": url("b10")}},
+            },
+        )
+
+    def next_ids(self, **kwargs):
+        return self.source.next_chapter_meta_ids(self.data, **kwargs)
+
+    def test_next_chapter_in_each_group(self):
+        self.assertEqual(self.next_ids(chapter="1"), ["a2", "b10"])
+
+    def test_group_missing_from_later_chapters(self):
+        self.assertEqual(self.next_ids(chapter="2"), [])
+
+    def test_unknown_chapter(self):
+        self.assertEqual(self.next_ids(chapter="3"), [])
+
+    def test_non_numeric_chapters_skipped(self):
+        self.assertEqual(self.next_ids(chapter="extra"), [])
+        self.assertNotIn("bx", self.next_ids(chapter="1"))
+
+    def test_last_chapter(self):
+        self.assertEqual(self.next_ids(chapter="10"), [])
+
+    def test_lookup_by_chapter_meta_id(self):
+        self.assertEqual(self.next_ids(chapter_meta_id="b1"), ["b10"])
+        self.assertEqual(self.next_ids(chapter_meta_id="a1"), ["a2"])
+        self.assertEqual(self.next_ids(chapter_meta_id="unknown"), [])
+
+
+class BatchSource(RecordSource):
+    def chapter_api_handler(self, meta_id):
+        if meta_id == "broken":
+            raise ProxyException("down")
+        return ChapterAPI(series="x", pages=[f"{meta_id}.png"], chapter=meta_id)
+
+
+@override_settings(PROXY_CHAPTER_BATCH_MAX=3, PROXY_CHAPTER_BATCH_RATE="10/m")
+class ChapterBatchTests(ApiCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.source = BatchSource(make_record())
+
+    def post(self, body):
+        return self.source.chapter_batch_view(
+            self.factory.post("/", json.dumps(body), content_type="application/json")
+        )
+
+    def test_streams_each_chapter(self):
+        response = self.post({"chapters": ["a", "b", "broken"]})
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)),
+            {"a": ["a.png"], "b": ["b.png"], "broken": None},
+        )
+
+    def test_rejects_invalid_batches(self):
+        for body in ({"chapters": []}, {"chapters": [1]}, {"chapters": ["a"] * 4}):
+            self.assertEqual(self.post(body).status_code, 400)
+
+    def test_rejects_more_chapters_than_the_cap(self):
+        response = self.post({"chapters": ["a", "b", "c", "d"]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reader_page_gets_the_cap(self):
+        response = self.source.reader_view(self.factory.get("/"), "x", "1", "1")
+        self.assertContains(response, "const CHAPTER_BATCH_MAX = 3;")
+
+    @override_settings(PROXY_CHAPTER_BATCH_RATE="2/m")
+    def test_rate_limited_by_client(self):
+        self.post({"chapters": ["a"]})
+        self.post({"chapters": ["a"]})
+        with self.assertRaises(Ratelimited):
+            self.post({"chapters": ["a"]})
+
+
+class MetricsViewTests(ApiCacheTestCase):
+    def scrape(self):
+        request = RequestFactory().get("/", REMOTE_ADDR="127.0.0.1")
+        request.user = AnonymousUser()
+        return metrics(request).content.decode()
+
+    def test_reports_local_cache_stats(self):
+        source = FakeSource({"v": 1})
+        source.handler("x")
+        source.handler("x")
+        output = self.scrape()
+        self.assertIn("# TYPE cubari_local_cache_hits_total counter", output)
+        self.assertRegex(output, r"cubari_local_cache_entries\{worker=\"\d+\"\} 1\n")
+        self.assertRegex(output, r"cubari_local_cache_hits_total\{[^}]*\} [1-9]")
+        self.assertIn("cubari_local_cache_misses_total", output)
+
+    @override_settings(PROXY_CONNECTION_POOLS={"default": 5})
+    def test_reports_connection_pools(self):
+        self.addCleanup(sessions.reset_sessions)
+        session = sessions.get_session("https://example.com/")
+        session.get_adapter("https://").poolmanager.connection_from_url(
+            "https://example.com/"
+        )
+        self.assertEqual(
+            sessions.pool_stats(),
+            {
+                "https://example.com": {
+                    "max_size": 5,
+                    "connections_opened": 0,
+                    "requests": 0,
+                }
+            },
+        )
+        output = self.scrape()
+        self.assertRegex(
+            output,
+            r'cubari_upstream_pool_max_size\{pool="https://example.com",worker="\d+"\} 5\n',
+        )
+        self.assertIn("# TYPE cubari_upstream_pool_requests_total counter", output)
+
+    def test_hidden_from_forwarded_requests(self):
+        request = RequestFactory().get(
+            "/", REMOTE_ADDR="127.0.0.1", HTTP_X_FORWARDED_FOR="1.2.3.4"
+        )
+        request.user = AnonymousUser()
+        with self.assertRaises(Http404):
+            metrics(request)
+
+
+class CircuitBreakerTests(ApiCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1600000000.0
+        clock = mock.patch.object(breaker, "unix_time", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = breaker.CircuitBreaker("example.com")
+
+    def trip(self):
+        for _ in range(breaker.BREAKER_MAX_FAILURES):
+            self.breaker.record_failure(self.breaker.before_request())
+
+    def test_closed_to_open_to_half_open_to_closed(self):
+        self.assertEqual(self.breaker.state()[0], breaker.CLOSED)
+        self.trip()
+        self.assertEqual(self.breaker.state()[0], breaker.OPEN)
+        with self.assertRaises(ProxyBusyException):
+            self.breaker.before_request()
+
+        self.now += breaker.BREAKER_COOLDOWN
+        self.assertEqual(self.breaker.state()[0], breaker.HALF_OPEN)
+        self.assertTrue(self.breaker.before_request())
+        # Only one probe at a time; everyone else keeps failing fast.
+        with self.assertRaises(ProxyBusyException):
+            self.breaker.before_request()
+
+        self.breaker.record_success(True)
+        self.assertEqual(self.breaker.state()[0], breaker.CLOSED)
+        self.assertEqual(self.breaker.failures(), 0)
+        self.assertFalse(self.breaker.before_request())
+
+    def test_failed_probe_reopens_with_longer_cooldown(self):
+        self.trip()
+        self.now += breaker.BREAKER_COOLDOWN
+        self.breaker.record_failure(self.breaker.before_request())
+        self.assertEqual(self.breaker.state()[0], breaker.OPEN)
+        self.now += breaker.BREAKER_COOLDOWN
+        self.assertEqual(self.breaker.state()[0], breaker.OPEN)
+        self.now += breaker.BREAKER_COOLDOWN
+        self.assertEqual(self.breaker.state()[0], breaker.HALF_OPEN)
+
+    def test_open_circuit_not_negative_cached(self):
+        source = FakeSource({"v": 1})
+        fetch = source.fetch
+
+        def guarded_fetch(meta_id):
+            probe = self.breaker.before_request()
+            result = fetch(meta_id)
+            self.breaker.record_success(probe)
+            return result
+
+        source.fetch = guarded_fetch
+        self.trip()
+        with self.assertRaises(ProxyBusyException):
+            source.handler("x")
+        self.now += breaker.BREAKER_COOLDOWN
+        self.assertEqual(source.handler("x"), {"v": 1})
+        self.assertEqual(
+            breaker.CircuitBreaker("example.com").state()[0], breaker.CLOSED
+        )
+
+
+class MetricsFlushTests(ApiCacheTestCase):
+    def test_counters_flushed_off_the_calling_thread(self):
+        flushed = threading.Event()
+        flushing_threads = []
+        flush = source_metrics.flush
+
+        def recording_flush():
+            flushing_threads.append(threading.current_thread())
+            flush()
+            flushed.set()
+
+        with mock.patch.object(source_metrics, "flush", recording_flush):
+            source_metrics.inc("cubari_test_total")
+            self.assertTrue(flushed.wait(source_metrics.METRICS_FLUSH_INTERVAL + 5))
+        self.assertNotIn(threading.current_thread(), flushing_threads)
+        self.assertEqual(cache.get(source_metrics._key("cubari_test_total", ())), 1)
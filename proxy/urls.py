@@ -1,9 +1,10 @@
 from django.urls import include, path, re_path
 from django.views.decorators.http import condition
 
-from . import sources
+from . import sources, views
 
 urlpatterns = [
+    path("metrics/", views.metrics, name="proxy-metrics"),
     path(
         "api/",
         include(
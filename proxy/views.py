@@ -1,4 +1,62 @@
-from django.shortcuts import render
+import os
 
-# Create your views here.
-# TODO add a hitcount view here
\ No newline at end of file
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.cache import never_cache
+
+from .source.breaker import OPEN, HALF_OPEN, breaker_states
+from .source.helpers import local_cache
+from .source.metrics import render
+from .source.sessions import pool_stats
+
+BREAKER_STATE_VALUES = {OPEN: 2, HALF_OPEN: 1}
+
+
+def _metrics_allowed(request):
+    # Scrapers talk to the app server directly, so only trust the socket
+    # address, and only when no reverse proxy has forwarded the request.
+    return request.user.is_staff or (
+        request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+        and "HTTP_X_FORWARDED_FOR" not in request.META
+    )
+
+
+@never_cache
+def metrics(request):
+    if not _metrics_allowed(request):
+        raise Http404("Page does not exist.")
+    gauges = []
+    for breaker in breaker_states():
+        labels = {"host": breaker["hostname"]}
+        gauges.append(
+            (
+                "cubari_breaker_state",
+                labels,
+                BREAKER_STATE_VALUES.get(breaker["state"], 0),
+            )
+        )
+        gauges.append(("cubari_breaker_failures", labels, breaker["failures"]))
+    # The local cache lives in each worker, so this only covers the worker
+    # that happened to answer the scrape.
+    worker = {"worker": str(os.getpid())}
+    stats = local_cache.stats()
+    for stat in ("entries", "bytes"):
+        gauges.append((f"cubari_local_cache_{stat}", worker, stats[stat]))
+    for stat in ("hits", "misses", "evictions"):
+        gauges.append((f"cubari_local_cache_{stat}_total", worker, stats[stat]))
+    for pool, stats in pool_stats().items():
+        labels = {**worker, "pool": pool}
+        gauges.append(("cubari_upstream_pool_max_size", labels, stats["max_size"]))
+        gauges.append(
+            (
+                "cubari_upstream_pool_connections_opened_total",
+                labels,
+                stats["connections_opened"],
+            )
+        )
+        gauges.append(
+            ("cubari_upstream_pool_requests_total", labels, stats["requests"])
+        )
+    return HttpResponse(
+        render(gauges), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
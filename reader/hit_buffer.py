@@ -0,0 +1,123 @@
+import atexit
+import logging
+import os
+import threading
+import weakref
+from time import monotonic
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+_buffers = weakref.WeakSet()
+
+
+class HitBuffer:
+    """Write-behind hit counter.
+
+    Hits are counted in memory under any hashable key, and every
+    HIT_FLUSH_INTERVAL seconds a background thread hands the batch to
+    `write`, so neither sync nor async views touch the database to count a
+    view. A batch that fails to write is kept for the next flush, and
+    whatever is pending when the process exits is written out then.
+    """
+
+    def __init__(self, name, write):
+        self.name = name
+        self.write = write
+        self.reset()
+        _buffers.add(self)
+
+    def reset(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flushing = None
+        self.last_flush = monotonic()
+
+    def add(self, key, hits=1):
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + hits
+            if (
+                self.flushing
+                or monotonic() - self.last_flush < settings.HIT_FLUSH_INTERVAL
+            ):
+                return
+            thread = self.flushing = threading.Thread(
+                target=self.flush_in_background, name=f"{self.name}_flush", daemon=True
+            )
+        thread.start()
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Flushing {self.name} hits failed: {e}")
+        finally:
+            # This thread's connection would otherwise never be closed.
+            connection.close()
+            with self.lock:
+                self.flushing = None
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.last_flush = monotonic()
+        if not pending:
+            return
+        try:
+            self.write(pending)
+        except Exception:
+            # Put the batch back, so the next flush writes it instead.
+            with self.lock:
+                for key, hits in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + hits
+            raise
+
+
+def _reset_buffers():
+    for buffer in _buffers:
+        buffer.reset()
+
+
+os.register_at_fork(after_in_child=_reset_buffers)
+
+
+@atexit.register
+def _flush_buffers():
+    for buffer in list(_buffers):
+        # Let a batch that's already being written finish first.
+        flushing = buffer.flushing
+        if flushing:
+            flushing.join()
+        try:
+            buffer.flush()
+        except Exception as e:
+            logger.warning(f"Flushing {buffer.name} hits at exit failed: {e}")
+
+
+def bulk_add_hits(model, fields, hits):
+    """Adds hits, keyed by tuples of the values of `fields`, to the rows of
+    model, creating the ones that don't exist yet. One query finds the
+    existing rows, then one bulk_update and one bulk_create write them."""
+    if not hits:
+        return
+    lookup = {
+        f"{field}__in": {key[i] for key in hits} for i, field in enumerate(fields)
+    }
+    existing = []
+    seen = set()
+    for row in model.objects.filter(**lookup):
+        key = tuple(getattr(row, field) for field in fields)
+        if key in hits and key not in seen:
+            seen.add(key)
+            row.hits = F("hits") + hits[key]
+            existing.append(row)
+    model.objects.bulk_update(existing, ["hits"])
+    model.objects.bulk_create(
+        model(**dict(zip(fields, key)), hits=count)
+        for key, count in hits.items()
+        if key not in seen
+    )
@@ -1,3 +1,70 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from . import users_cache_lib
+from .hit_buffer import HitBuffer
+from .users_cache_lib import ONLINE_WINDOW, mark_online, online_now, peak_traffic
+
+
+class HitBufferTests(SimpleTestCase):
+    def test_flush_hands_over_the_batch(self):
+        written = []
+        buffer = HitBuffer("test", written.append)
+        buffer.add("a")
+        buffer.add("a")
+        buffer.add("b", 3)
+        buffer.flush()
+        self.assertEqual(written, [{"a": 2, "b": 3}])
+        self.assertEqual(buffer.pending, {})
+
+    def test_failed_batch_kept_for_next_flush(self):
+        def fail(pending):
+            raise RuntimeError("database down")
+
+        buffer = HitBuffer("test", fail)
+        buffer.add("a", 2)
+        with self.assertRaises(RuntimeError):
+            buffer.flush()
+        buffer.add("a")
+        written = []
+        buffer.write = written.append
+        buffer.flush()
+        self.assertEqual(written, [{"a": 3}])
+
+
+class OnlineNowTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def at(self, when):
+        return mock.patch.object(users_cache_lib, "unix_time", return_value=when)
+
+    def test_each_ip_counted_once_per_window(self):
+        start = ONLINE_WINDOW * 1000
+        with self.at(start):
+            for ip in ("1.1.1.1", "1.1.1.1", "2.2.2.2"):
+                mark_online(ip)
+            self.assertEqual(online_now(), 2)
+
+    def test_previous_window_fades_out(self):
+        start = ONLINE_WINDOW * 1000
+        with self.at(start):
+            for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4"):
+                mark_online(ip)
+        with self.at(start + ONLINE_WINDOW * 1.5):
+            mark_online("1.1.1.1")
+            self.assertEqual(online_now(), 1 + 2)
+
+    def test_peak_is_the_busiest_window(self):
+        start = ONLINE_WINDOW * 1000
+        with self.at(start):
+            for ip in ("1.1.1.1", "2.2.2.2"):
+                mark_online(ip)
+        with self.at(start + ONLINE_WINDOW):
+            # Seen in both windows, which online_now() counts twice.
+            mark_online("1.1.1.1")
+            mark_online("2.2.2.2")
+            self.assertEqual(online_now(), 4)
+        self.assertEqual(peak_traffic(), 2)
@@ -1,5 +1,12 @@
+from time import time as unix_time
+
 from django.core.cache import cache
 
+ONLINE_PREFIX = "online/"
+ONLINE_WINDOW = 600  # Seen in the last 10 minutes counts as online.
+PEAK_TRAFFIC_KEY = "peak_traffic"
+PEAK_TRAFFIC_TTL = 3600 * 8
+
 
 def get_user_ip(request):
     x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
@@ -8,3 +15,48 @@ def get_user_ip(request):
     else:
         user_ip = request.META.get("REMOTE_ADDR")
     return user_ip
+
+
+def _window_count_key(window):
+    return f"{ONLINE_PREFIX}{window}/count"
+
+
+def _incr(key, ttl):
+    cache.add(key, 0, ttl)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, ttl)
+        return 1
+
+
+def mark_online(user_ip):
+    """Counts each IP once per ONLINE_WINDOW with an atomic counter per
+    window. An IP that was already counted in the current window costs a
+    single cache.add."""
+    window = int(unix_time() // ONLINE_WINDOW)
+    if not cache.add(f"{ONLINE_PREFIX}{window}/{user_ip}", 1, ONLINE_WINDOW):
+        return
+    seen = _incr(_window_count_key(window), ONLINE_WINDOW * 2)
+    # The window's count is exact, unlike online_now(), so it's what the
+    # peak is taken from.
+    if seen > (cache.get(PEAK_TRAFFIC_KEY) or 0):
+        cache.set(PEAK_TRAFFIC_KEY, seen, PEAK_TRAFFIC_TTL)
+
+
+def online_now():
+    """Estimated number of IPs seen in the last ONLINE_WINDOW seconds: the
+    current window's count plus the share of the previous window's count
+    that still overlaps the last ONLINE_WINDOW seconds. Each window counts
+    an IP once, but an IP seen in both is counted in both, so this runs high
+    by up to the overlapping share of the previous window's count."""
+    now = unix_time()
+    window = int(now // ONLINE_WINDOW)
+    current, previous = _window_count_key(window), _window_count_key(window - 1)
+    counts = cache.get_many([current, previous])
+    overlap = 1 - (now % ONLINE_WINDOW) / ONLINE_WINDOW
+    return round(counts.get(current, 0) + counts.get(previous, 0) * overlap)
+
+
+def peak_traffic():
+    return cache.get(PEAK_TRAFFIC_KEY) or 0